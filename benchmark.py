@@ -0,0 +1,365 @@
+"""Benchmarks for asset loading, game logic and frame composition.
+
+Run from the project directory:
+    python benchmark.py [--save-baseline | --compare] [-k PATTERN]
+
+Results are printed as JSON (or written to --output). --save-baseline
+stores them as the baseline, --compare reports how they differ from it
+and exits with status 1 if anything got slower than --threshold allows.
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import BytesIO
+import json
+import os
+import platform
+import statistics
+import sys
+from time import perf_counter
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+# Keep stdout for the results
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import pygame
+
+from constants import HEIGHT, PIC_DIR, WIDTH
+from internal_events import InternalEvent
+from libs.olbmp import OLBitMap
+from pysnake import MainApp, get_resource
+
+
+BASELINE_PATH = "benchmark_baseline.json"
+MIN_TIME = 0.2
+REPEAT = 5
+THRESHOLD = 0.1
+SNAKE_LENGTHS = (3, 100, 1000, 5000)
+
+EVENT_NAME = 'benchmark'
+EVENT_HANDLER_COUNTS = (0, 1, 10)
+
+
+def timed(func):
+    """Make a benchmark out of a function taking no arguments."""
+    def bench(number):
+        started_at = perf_counter()
+        for i in range(number):
+            func()
+
+        return perf_counter() - started_at
+
+    return bench
+
+
+def run_benchmark(bench, min_time=MIN_TIME, repeat=REPEAT):
+    """Return timings of a single iteration of the benchmark in seconds.
+
+    bench(number) runs the given number of iterations and returns how long
+    the measured part took. The number is picked so that a run takes at
+    least min_time, then the run is repeated.
+    """
+    number = 1
+    while True:
+        elapsed = bench(number)
+        if elapsed >= min_time:
+            break
+
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+    timings = [elapsed / number]
+    for i in range(repeat - 1):
+        timings.append(bench(number) / number)
+
+    return {
+        'number': number,
+        'min': min(timings),
+        'median': statistics.median(timings),
+    }
+
+
+def setup_app():
+    pygame.init()
+
+    app = MainApp([], headless=True)
+
+    import modules
+
+    InternalEvent.fire('load', app=app)
+
+    # Headless apps finish loading assets on the first tick
+    app.loop_headless(1)
+    return app
+
+
+def get_asset_benchmarks():
+    pic_dir = get_resource(PIC_DIR)
+    for name in sorted(os.listdir(pic_dir)):
+        path = os.path.join(pic_dir, name)
+        name = os.path.splitext(name)[0]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        image = OLBitMap(data)
+
+        yield "olbmp.load_file[{}]".format(name), timed(
+            lambda path=path: OLBitMap(path))
+
+        yield "olbmp.load_bytes[{}]".format(name), timed(
+            lambda data=data: OLBitMap(data))
+
+        yield "olbmp.save[{}]".format(name), timed(
+            lambda image=image: image.save(BytesIO()))
+
+        yield "olbmp.to_surface[{}]".format(name), timed(image.to_surface)
+
+
+def get_field_benchmarks():
+    from modules import field
+
+    chunks = field.FieldChunks(field.field_image)
+    yield "field.render_chunk", timed(lambda: chunks.render_chunk((0, 0)))
+
+    yield "field.render[shadows]", timed(
+        field.AreaWideImage(field.shadows_image).render)
+
+
+def build_snake(length, x=None, y=None):
+    from modules.snake import INIT_X, INIT_Y, Snake
+
+    snake = Snake(INIT_X if x is None else x, INIT_Y if y is None else y)
+    for i in range(length):
+        snake.increment()
+
+    return snake
+
+
+def get_snake_route(speed):
+    """Return directions to set before each tick so that a snake starting
+    in the top left corner sweeps the field row by row."""
+    from modules.game import playground
+    from modules.snake import Direction
+
+    ticks_per_node = round(1 / speed)
+    row_ticks = (playground.width - 1) * ticks_per_node
+
+    route = []
+    for row in range(playground.height):
+        if row:
+            route += [Direction.DOWN] + [None] * (ticks_per_node - 1)
+
+        direction = Direction.LEFT if row % 2 else Direction.RIGHT
+        route += [direction] + [None] * (row_ticks - 1)
+
+    return route
+
+
+def bench_snake_tick(length):
+    from modules.game import playground
+
+    def bench(number):
+        elapsed = 0
+        while number > 0:
+            # The head only enters free cells on its way, the rest of the
+            # body trails off the field
+            snake = build_snake(length, playground.minx, playground.miny)
+            route = get_snake_route(snake.speed)[:number]
+
+            started_at = perf_counter()
+            for direction in route:
+                if direction is not None:
+                    snake.next_direction = direction
+
+                snake.tick()
+
+            elapsed += perf_counter() - started_at
+
+            if not snake.active:
+                raise RuntimeError("Snake crashed during the benchmark")
+
+            # Free the playground cells for the next snake
+            snake.clear()
+            number -= len(route)
+
+        return elapsed
+
+    return bench
+
+
+def get_snake_benchmarks():
+    dest = pygame.Surface((WIDTH, HEIGHT))
+    for length in SNAKE_LENGTHS:
+        yield "snake.tick[{}]".format(length), bench_snake_tick(length)
+
+        snake = build_snake(length)
+        yield "snake.check_collision[{}]".format(length), timed(
+            snake.check_collision)
+
+        yield "snake.render[{}]".format(length), timed(snake.render)
+
+        yield "snake.draw[{}]".format(length), timed(
+            lambda snake=snake: snake.draw(dest))
+
+
+def get_event_benchmarks():
+    for count in EVENT_HANDLER_COUNTS:
+        def bench(number, count=count):
+            handlers = [lambda **kwargs: None for i in range(count)]
+            for handler in handlers:
+                InternalEvent(EVENT_NAME).register(handler)
+
+            try:
+                return timed(lambda: InternalEvent.fire(
+                    EVENT_NAME, value=None))(number)
+
+            finally:
+                for handler in handlers:
+                    InternalEvent(EVENT_NAME).unregister(handler)
+
+        yield "internal_event.fire[{}]".format(count), bench
+
+
+def get_frame_benchmarks(app):
+    # Draw a game in progress rather than the loading screen
+    InternalEvent.fire('game_start')
+    app.loop_headless(app.tick_number + 10)
+
+    def draw_full():
+        app._draw_full()
+
+    def draw_dirty():
+        if not app._draw_dirty():
+            raise RuntimeError("Dirty rendering fell back to a full redraw")
+
+    yield "frame.background", timed(app._render_background)
+    yield "frame.full", timed(draw_full)
+    yield "frame.dirty", timed(draw_dirty)
+
+
+def get_benchmarks(app):
+    yield from get_asset_benchmarks()
+    yield from get_field_benchmarks()
+    yield from get_snake_benchmarks()
+    yield from get_event_benchmarks()
+
+    # Last, as it starts a game
+    yield from get_frame_benchmarks(app)
+
+
+def compare(results, baseline, threshold):
+    """Print how results differ from the baseline to stderr.
+
+    Best timings are compared, being the least affected by noise. Return
+    names of benchmarks that got slower.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print("{:40} {:>12} (new)".format(
+                name, format_time(result['min'])), file=sys.stderr)
+
+            continue
+
+        ratio = result['min'] / baseline[name]['min']
+        if ratio > 1 + threshold:
+            status = "SLOWER"
+            regressions.append(name)
+
+        elif ratio < 1 - threshold:
+            status = "faster"
+
+        else:
+            status = ""
+
+        print("{:40} {:>12} {:>12} {:>7.2f}x {}".format(
+            name, format_time(baseline[name]['min']),
+            format_time(result['min']), ratio, status), file=sys.stderr)
+
+    return regressions
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return "{:.3f}{}".format(seconds * scale, unit)
+
+    return "{:.0f}ns".format(seconds * 1e9)
+
+
+def main(argv):
+    parser = ArgumentParser(description="Run PySnake benchmarks")
+    parser.add_argument(
+        '-k', metavar='PATTERN', default='',
+        help="only run benchmarks with PATTERN in their names")
+
+    parser.add_argument(
+        '--output', metavar='FILE', help="write results to FILE")
+
+    parser.add_argument(
+        '--baseline', metavar='FILE', default=BASELINE_PATH,
+        help="baseline file (default: %(default)s)")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--save-baseline', action='store_true',
+        help="store results as the baseline")
+
+    group.add_argument(
+        '--compare', action='store_true',
+        help="compare results against the baseline")
+
+    parser.add_argument(
+        '--threshold', type=float, default=THRESHOLD,
+        help="relative slowdown reported as a regression "
+             "(default: %(default)s)")
+
+    parser.add_argument('--min-time', type=float, default=MIN_TIME)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+
+    args = parser.parse_args(argv)
+
+    # Modules print while loading, keep stdout for the results
+    with redirect_stdout(sys.stderr):
+        app = setup_app()
+
+        results = {}
+        for name, bench in get_benchmarks(app):
+            if args.k not in name:
+                continue
+
+            results[name] = run_benchmark(bench, args.min_time, args.repeat)
+            print("{:40} {:>12}".format(
+                name, format_time(results[name]['min'])))
+
+    report = {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'benchmarks': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -9,3 +9,7 @@ NODE_W = 32
 NODE_H = 32
 FIELD_W_NODES = 40
 FIELD_H_NODES = 22
+CHUNK_W_NODES = 16
+CHUNK_H_NODES = 16
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pysnake", "cache")
+CACHE_MAX_SIZE = 64 * 1024 * 1024
@@ -1,10 +1,31 @@
+from collections import OrderedDict
+import mmap
 import os.path
+import struct
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
 
 
 INIT_COLOR = (255, 255, 255, 255)
-VERSION = 1
+VERSION = 2
+COMPRESSION_LEVEL = 9
+ROW_CACHE_SIZE = 16
 
 # Don't change values below
+SUPPORTED_VERSIONS = (1, 2)
+HEADER_SIZE = 10
+PIXEL_SIZE = 4
+COMPRESSION_ZLIB = 1
+ROW_TABLE_OFFSET = 1
 MAX_WIDTH = 65535
 MAX_HEIGHT = 65535
 
@@ -14,23 +35,39 @@ class CorruptedFile(Exception):
 
 
 class OLBitMap:
-    def __init__(self, source):
+    def __init__(self, source, lazy=False):
+        self._mmap = None
+
+        # Lazily loaded compressed images only decompress rows as they're
+        # accessed, until something needs all the pixels at once
+        self._row_offsets = None
+        self._rows_start = None
+        self._row_cache = OrderedDict()
+
         if isinstance(source, OLBitMap):
             self._copy(source)
             return
 
+        if hasattr(source, 'readinto'):
+            self._load_file(source)
+            return
+
         if hasattr(source, 'read'):
             self._load_bin_data(source.read())
             return
 
-        if isinstance(source, bytes):
+        if isinstance(source, (bytes, bytearray, memoryview)):
             self._load_bin_data(source)
             return
 
         if isinstance(source, str) and os.path.isfile(source):
             with open(source, 'rb') as f:
-                self._load_bin_data(f.read())
-                return
+                if lazy:
+                    self._map_file(f)
+                else:
+                    self._load_file(f)
+
+            return
 
         if hasattr(source, '__iter__'):
             if len(source) != 2:
@@ -45,37 +82,192 @@ class OLBitMap:
             "object, OLBitMap instance, bytes or (width,height) tuple - "
             "'{}' instance found instead".format(type(source)))
 
-    def _load_bin_data(self, bindata):
-        if bindata[:5].decode('ascii') != 'OLBMP':
+    def _parse_header(self, header):
+        if bytes(header[:5]) != b'OLBMP':
             raise IOError("Missing OLBMP header")
 
-        self.version = bindata[5]
-        self.width = bindata[6] * 256 + bindata[7]
-        self.height = bindata[8] * 256 + bindata[9]
+        if len(header) < HEADER_SIZE:
+            raise CorruptedFile("OLBMP header is truncated")
+
+        self.version = header[5]
+        self.width = header[6] * 256 + header[7]
+        self.height = header[8] * 256 + header[9]
+
+        if self.version not in SUPPORTED_VERSIONS:
+            raise CorruptedFile(
+                "Unsupported OLBMP version: {}".format(self.version))
+
+    def _check_payload(self, length):
+        size = self.width * self.height * PIXEL_SIZE
+        if length < size:
+            raise CorruptedFile(
+                "Expected {} bytes of pixel data, {} found".format(
+                    size, length))
+
+        return size
+
+    def _parse_row_table(self, data):
+        if len(data) < ROW_TABLE_OFFSET + 4 * (self.height + 1):
+            raise CorruptedFile("Row offset table is truncated")
+
+        if data[0] != COMPRESSION_ZLIB:
+            raise CorruptedFile(
+                "Unsupported compression method: {}".format(data[0]))
+
+        return struct.unpack_from(
+            '>{}I'.format(self.height + 1), data, ROW_TABLE_OFFSET)
+
+    def _decompress_row(self, chunk, i):
+        row_size = self.width * PIXEL_SIZE
+
+        # Empty rows are stored without any compressed data
+        if not row_size:
+            return b''
+
+        try:
+            row = zlib.decompress(chunk)
+        except zlib.error as e:
+            raise CorruptedFile(
+                "Row {} can't be decompressed: {}".format(i, e)) from e
+
+        if len(row) != row_size:
+            raise CorruptedFile("Row {} has wrong length".format(i))
+
+        return row
+
+    def _decode_rows(self, chunks):
+        row_size = self.width * PIXEL_SIZE
+        pixels = memoryview(bytearray(row_size * self.height))
+
+        for i, chunk in enumerate(chunks):
+            pixels[i * row_size:(i + 1) * row_size] = self._decompress_row(
+                chunk, i)
+
+        return pixels
+
+    def _load_bin_data(self, bindata):
+        bindata = memoryview(bindata).cast('B')
+        self._parse_header(bindata)
+        payload = bindata[HEADER_SIZE:]
+
+        if self.version == 1:
+            size = self._check_payload(len(payload))
+
+            # No copy is made here: the pixels keep referencing the payload
+            self._pixels = payload[:size]
+            return
+
+        offsets = self._parse_row_table(payload)
+        rows = payload[ROW_TABLE_OFFSET + 4 * len(offsets):]
+        if len(rows) < offsets[-1]:
+            raise CorruptedFile("Compressed row data is truncated")
+
+        self._pixels = self._decode_rows(
+            rows[start:end] for start, end in zip(offsets, offsets[1:]))
+
+    def _load_file(self, f):
+        self._parse_header(f.read(HEADER_SIZE))
+
+        if self.version == 1:
+            # Read straight into the pixel buffer, no intermediate copy
+            pixels = bytearray(self.width * self.height * PIXEL_SIZE)
+            self._check_payload(f.readinto(pixels))
+            self._pixels = memoryview(pixels)
+            return
+
+        table = f.read(ROW_TABLE_OFFSET + 4 * (self.height + 1))
+        offsets = self._parse_row_table(table)
+        self._pixels = self._decode_rows(self._read_rows(f, offsets))
+
+    def _read_rows(self, f, offsets):
+        for start, end in zip(offsets, offsets[1:]):
+            chunk = f.read(end - start)
+            if len(chunk) < end - start:
+                raise CorruptedFile("Compressed row data is truncated")
+
+            yield chunk
+
+    def _map_file(self, f):
+        self._parse_header(f.read(HEADER_SIZE))
+        file_size = os.fstat(f.fileno()).st_size
+
+        if self.version == 1:
+            size = self._check_payload(file_size - HEADER_SIZE)
+
+            # ACCESS_COPY keeps writes private to this instance; pages are
+            # only read from disk when they're touched
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._pixels = memoryview(self._mmap)[
+                HEADER_SIZE:HEADER_SIZE + size]
+
+            return
+
+        table = f.read(ROW_TABLE_OFFSET + 4 * (self.height + 1))
+        offsets = self._parse_row_table(table)
+        rows_start = HEADER_SIZE + len(table)
+        if file_size - rows_start < offsets[-1]:
+            raise CorruptedFile("Compressed row data is truncated")
+
+        # Compressed rows are sliced out of the mapping when they're needed
+        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._row_offsets = offsets
+        self._rows_start = rows_start
+        self._pixels = None
+
+    def _get_pixels(self):
+        """Return the pixel buffer, decoding all rows of a lazily loaded
+        compressed image first."""
+        if self._pixels is None:
+            self._pixels = self._decode_rows(
+                self._get_chunk(i) for i in range(self.height))
+
+            self._row_cache.clear()
+
+        return self._pixels
+
+    def _get_chunk(self, i):
+        start = self._rows_start + self._row_offsets[i]
+        end = self._rows_start + self._row_offsets[i + 1]
+        return self._mmap[start:end]
+
+    def _get_lazy_row(self, i):
+        row = self._row_cache.get(i)
+        if row is not None:
+            self._row_cache.move_to_end(i)
+            return row
+
+        row = self._row_cache[i] = self._decompress_row(self._get_chunk(i), i)
+        if len(self._row_cache) > ROW_CACHE_SIZE:
+            self._row_cache.popitem(last=False)
+
+        return row
+
+    def close(self):
+        """Release the file mapping of a lazily loaded image."""
+        if self._mmap is None:
+            return
 
-        self._bitmap = [[None, ] * self.width for i in range(self.height)]
+        if self._pixels is not None:
+            self._pixels.release()
 
-        for i in range(self.height):
-            for j in range(self.width):
-                offset = 10 + i*self.width*4 + j*4
-                r = bindata[offset + 0]
-                g = bindata[offset + 1]
-                b = bindata[offset + 2]
-                a = bindata[offset + 3]
+        self._pixels = memoryview(b'').toreadonly()
+        self._row_offsets = None
+        self._row_cache.clear()
+        self._mmap.close()
+        self._mmap = None
+        self.width = self.height = 0
 
-                self._bitmap[i][j] = (r, g, b, a)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _copy(self, source):
         self.version = source.version
         self.width, self.height = source.width, source.height
 
-        self._bitmap = []
-        for row in source._bitmap:
-            new_row = []
-            for pixel in row:
-                new_row.append(pixel[:])
-
-            self._bitmap.append(new_row)
+        self._pixels = memoryview(bytearray(source._get_pixels()))
 
     def _new(self, width, height):
         if width > MAX_WIDTH:
@@ -96,7 +288,72 @@ class OLBitMap:
         self.width = width
         self.height = height
 
-        self._bitmap = [[INIT_COLOR, ] * height for j in range(width)]
+        self._pixels = memoryview(bytearray(INIT_COLOR) * (width * height))
+
+    def get_buffer(self):
+        """Return a read-only view of the raw RGBA pixel data."""
+        return self._get_pixels().toreadonly()
+
+    def get_array(self):
+        """Return a (height, width, 4) NumPy array sharing the pixel data."""
+        if numpy is None:
+            raise ImportError("NumPy is required to get an array view")
+
+        return numpy.frombuffer(self._get_pixels(), dtype=numpy.uint8).reshape(
+            self.height, self.width, PIXEL_SIZE)
+
+    def get_row(self, i):
+        """Return a read-only view of the i-th row of pixels."""
+        if not 0 <= i < self.height:
+            raise IndexError("Row {} is out of image bounds".format(i))
+
+        if self._pixels is None:
+            return memoryview(self._get_lazy_row(i))
+
+        row_size = self.width * PIXEL_SIZE
+        return self._pixels[i * row_size:(i + 1) * row_size].toreadonly()
+
+    def get_region(self, x, y, width, height):
+        """Return RGBA data of the given rectangle as bytes."""
+        if (x < 0 or y < 0 or width < 0 or height < 0 or
+                x + width > self.width or y + height > self.height):
+
+            raise IndexError("Region ({}, {}, {}, {}) is out of image "
+                             "bounds".format(x, y, width, height))
+
+        if self._pixels is None:
+            start, end = x * PIXEL_SIZE, (x + width) * PIXEL_SIZE
+            return b''.join(
+                self._get_lazy_row(i)[start:end] for i in range(y, y + height))
+
+        if x == 0 and width == self.width:
+            return bytes(self._pixels[
+                y * width * PIXEL_SIZE:(y + height) * width * PIXEL_SIZE])
+
+        region = bytearray()
+        for i in range(y, y + height):
+            offset = (i * self.width + x) * PIXEL_SIZE
+            region += self._pixels[offset:offset + width * PIXEL_SIZE]
+
+        return bytes(region)
+
+    def to_surface(self):
+        """Build a pygame Surface with per-pixel alpha from this image.
+
+        The pixels are converted in a single call. If a display mode is set,
+        the surface is returned in the display's pixel format.
+        """
+        if pygame is None:
+            raise ImportError("pygame is required to build a Surface")
+
+        surface = pygame.image.frombuffer(
+            self._get_pixels(), (self.width, self.height), 'RGBA')
+
+        # Both convert_alpha and copy detach the surface from our buffer
+        if pygame.display.get_surface() is not None:
+            return surface.convert_alpha()
+
+        return surface.copy()
 
     def save(self, target):
         if hasattr(target, 'write'):
@@ -118,15 +375,68 @@ class OLBitMap:
         f.write(bytes((self.version, )))
         f.write(bytes((self.width // 256, self.width % 256)))
         f.write(bytes((self.height // 256, self.height % 256)))
-        for pixel in self:
-            f.write(bytes(pixel))
 
-    def __getitem__(self, xy):
+        if self.version == 1:
+            f.write(self._get_pixels())
+            return
+
+        f.write(bytes((COMPRESSION_ZLIB, )))
+
+        # Rows are compressed one at a time; the offset table is written
+        # in front of them once their sizes are known
+        # Rows of zero width are empty, so are all their offsets
+        if not self.width:
+            f.write(bytes(4 * (self.height + 1)))
+            return
+
+        offsets = [0]
+        if getattr(f, 'seekable', lambda: False)():
+            table_pos = f.tell()
+            f.write(bytes(4 * (self.height + 1)))
+            for chunk in self._compress_rows():
+                f.write(chunk)
+                offsets.append(offsets[-1] + len(chunk))
+
+            end_pos = f.tell()
+            f.seek(table_pos)
+            f.write(struct.pack('>{}I'.format(len(offsets)), *offsets))
+            f.seek(end_pos)
+            return
+
+        chunks = list(self._compress_rows())
+        for chunk in chunks:
+            offsets.append(offsets[-1] + len(chunk))
+
+        f.write(struct.pack('>{}I'.format(len(offsets)), *offsets))
+        for chunk in chunks:
+            f.write(chunk)
+
+    def _compress_rows(self):
+        pixels = self._get_pixels()
+        row_size = self.width * PIXEL_SIZE
+        for offset in range(0, row_size * self.height, row_size):
+            yield zlib.compress(
+                pixels[offset:offset + row_size], COMPRESSION_LEVEL)
+
+    def _offset(self, xy):
         j, i = xy
-        return self._bitmap[i][j]
+        if not (0 <= j < self.width and 0 <= i < self.height):
+            raise IndexError("Pixel ({}, {}) is out of image bounds".format(
+                j, i))
+
+        return (i * self.width + j) * PIXEL_SIZE
+
+    def __getitem__(self, xy):
+        offset = self._offset(xy)
+        if self._pixels is None:
+            j, i = xy
+            row = self._get_lazy_row(i)
+            return tuple(row[j * PIXEL_SIZE:(j + 1) * PIXEL_SIZE])
+
+        return tuple(self._pixels[offset:offset + PIXEL_SIZE])
 
     def __setitem__(self, xy, value):
-        j, i = xy
+        offset = self._offset(xy)
         if not hasattr(value, '__iter__'):
             raise TypeError("Pixel color value should be 4-element iterable")
 
@@ -142,7 +452,11 @@ class OLBitMap:
                 raise ValueError(
                     "Color components should be integers in range(0, 256)")
 
-        self._bitmap[i][j] = value
+        if self._get_pixels().readonly:
+            # Loaded from immutable bytes, detach before the first write
+            self._pixels = memoryview(bytearray(self._pixels))
+
+        self._pixels[offset:offset + PIXEL_SIZE] = bytes(value)
 
     def __str__(self):
         return "OLBitMap Image ({}x{})".format(self.width, self.height)
@@ -151,6 +465,31 @@ class OLBitMap:
         return self.width * self.height
 
     def __iter__(self):
-        for i in range(self.height):
-            for j in range(self.width):
-                yield self._bitmap[i][j]
+        pixels = self._get_pixels()
+        for offset in range(0, len(pixels), PIXEL_SIZE):
+            yield tuple(pixels[offset:offset + PIXEL_SIZE])
+
+
+def convert(source, target, version=VERSION):
+    """Re-encode an OLBMP file using the given format version."""
+    image = OLBitMap(source)
+    image.version = version
+    image.save(target)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        description="Convert OLBMP files to another format version in place")
+
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--version', type=int, default=VERSION,
+                        choices=SUPPORTED_VERSIONS)
+
+    args = parser.parse_args()
+    for path in args.files:
+        tmp_path = path + '.tmp'
+        convert(path, tmp_path, args.version)
+        os.replace(tmp_path, path)
+        print("{}: {} bytes".format(path, os.path.getsize(path)))
@@ -0,0 +1,48 @@
+class SpriteBatch:
+    """Keep (surface, position) pairs and draw them with one blits() call.
+
+    Sprites are drawn in the order they were added. Surfaces may be shared
+    between any number of sprites.
+    """
+    def __init__(self):
+        self._sprites = {}
+        self._sequence = None
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def __contains__(self, key):
+        return key in self._sprites
+
+    def add(self, key, surface, pos):
+        """Add a sprite or move an existing one."""
+        self._sprites[key] = surface, pos
+        self._sequence = None
+
+    def remove(self, key):
+        del self._sprites[key]
+        self._sequence = None
+
+    def clear(self):
+        self._sprites.clear()
+        self._sequence = None
+
+    def get_rects(self, offset=(0, 0)):
+        """Return rects draw() would touch with the same offset."""
+        offset_x, offset_y = offset
+        return [surface.get_rect(topleft=(x + offset_x, y + offset_y))
+                for surface, (x, y) in self._sprites.values()]
+
+    def draw(self, dest, offset=(0, 0)):
+        """Draw all sprites moved by the offset and return the list of
+        touched rects."""
+        if self._sequence is None:
+            self._sequence = list(self._sprites.values())
+
+        if offset == (0, 0):
+            return dest.blits(self._sequence)
+
+        offset_x, offset_y = offset
+        return dest.blits([
+            (surface, (x + offset_x, y + offset_y))
+            for surface, (x, y) in self._sequence])
@@ -0,0 +1,157 @@
+from hashlib import sha1
+import os
+import struct
+
+import pygame
+
+
+CACHE_VERSION = 1
+READ_CHUNK_SIZE = 65536
+ENTRY_EXT = '.surf'
+
+# Don't change values below
+ENTRY_MAGIC = b'PSSC'
+ENTRY_HEADER = struct.Struct('>4sHHHIIB4I')
+
+
+class SurfaceCache:
+    """Persistent cache of ready-to-blit surfaces built from asset files.
+
+    Entries store raw pixels in the display's pixel format and are keyed by
+    the content hash of the source file, so they stay valid no matter where
+    the file was unpacked to. Least recently used entries are evicted once
+    the cache grows past max_size bytes.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get(self, path, build, variant=''):
+        try:
+            entry_path = self._get_entry_path(path, variant)
+        except OSError:
+            return build()
+
+        surface = self._load_entry(entry_path)
+        if surface is not None:
+            return surface
+
+        surface = build()
+        try:
+            self._save_entry(entry_path, surface)
+            self._evict()
+        except OSError as e:
+            print("Failed to cache '{}': {}".format(path, e))
+
+        return surface
+
+    def clear(self):
+        for entry_path, size, mtime in self._list_entries():
+            os.remove(entry_path)
+
+    def _get_entry_path(self, path, variant):
+        hash_ = sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                hash_.update(chunk)
+
+        display = pygame.display.get_surface()
+        if display is None:
+            pixel_format = None
+        else:
+            pixel_format = display.get_bitsize(), display.get_masks()
+
+        key = "{}|{}|{}|{}".format(
+            CACHE_VERSION, hash_.hexdigest(), variant, pixel_format)
+
+        return os.path.join(
+            self.directory, sha1(key.encode('utf-8')).hexdigest() + ENTRY_EXT)
+
+    def _load_entry(self, entry_path):
+        try:
+            with open(entry_path, 'rb') as f:
+                header = f.read(ENTRY_HEADER.size)
+                data = f.read()
+
+        except OSError:
+            return None
+
+        if len(header) < ENTRY_HEADER.size:
+            return None
+
+        (magic, version, width, height, pitch,
+         flags, bitsize, *masks) = ENTRY_HEADER.unpack(header)
+
+        if magic != ENTRY_MAGIC or version != CACHE_VERSION:
+            return None
+
+        try:
+            surface = pygame.Surface((width, height), flags, bitsize, masks)
+            if surface.get_pitch() != pitch or len(data) != pitch * height:
+                return None
+
+            surface.get_buffer().write(data, 0)
+
+        except (ValueError, pygame.error) as e:
+            # Damaged header, the entry gets rebuilt
+            print("Dropping corrupt cache entry '{}': {}".format(
+                entry_path, e))
+            self._remove_entry(entry_path)
+            return None
+
+        # Touch the entry so that eviction sees it as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return surface
+
+    def _save_entry(self, entry_path, surface):
+        os.makedirs(self.directory, exist_ok=True)
+
+        width, height = surface.get_size()
+        header = ENTRY_HEADER.pack(
+            ENTRY_MAGIC, CACHE_VERSION, width, height, surface.get_pitch(),
+            surface.get_flags() & pygame.SRCALPHA, surface.get_bitsize(),
+            *surface.get_masks())
+
+        tmp_path = entry_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(surface.get_buffer().raw)
+
+        os.replace(tmp_path, entry_path)
+
+    def _remove_entry(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+    def _list_entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_EXT):
+                continue
+
+            entry_path = os.path.join(self.directory, name)
+            stat = os.stat(entry_path)
+            entries.append((entry_path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def _evict(self):
+        entries = self._list_entries()
+        total_size = sum(size for entry_path, size, mtime in entries)
+
+        entries.sort(key=lambda entry: entry[2])
+        for entry_path, size, mtime in entries:
+            if total_size <= self.max_size:
+                break
+
+            os.remove(entry_path)
+            total_size -= size
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from constants import CACHE_DIR, CACHE_MAX_SIZE, TICKRATE
+from internal_events import InternalEvent
+from libs.olbmp import OLBitMap
+from libs.surface_cache import SurfaceCache
+
+
+surface_cache = SurfaceCache(CACHE_DIR, CACHE_MAX_SIZE)
+registered_assets = []
+surfaces = {}
+pending = {}
+
+app_ = None
+executor = None
+
+
+class AssetLoadError(Exception):
+    pass
+
+
+def render_surface(path, rect=None):
+    with OLBitMap(path, lazy=True) as image:
+        surface = image.to_surface()
+
+    if rect is not None:
+        surface = surface.subsurface(rect).copy()
+
+    return surface
+
+
+def get_image_size(path):
+    """Return (width, height) of the image without decoding its pixels."""
+    with OLBitMap(path, lazy=True) as image:
+        return image.width, image.height
+
+
+def load_surface(path, rect=None):
+    return surface_cache.get(
+        path, lambda: render_surface(path, rect), variant=str(rect))
+
+
+def get_result(key, future):
+    """Return the surface loaded in the background, or raise
+    AssetLoadError naming the asset that failed."""
+    try:
+        return future.result()
+    except Exception as e:
+        path, rect = key
+        print("Failed to load '{}': {}".format(path, e))
+        raise AssetLoadError("Failed to load '{}'".format(path)) from e
+
+
+def register_asset(path, rect=None):
+    key = path, rect
+    if key not in registered_assets:
+        registered_assets.append(key)
+
+
+def get_surface(path, rect=None):
+    key = path, rect
+    if key in pending:
+        # Still loading in the background, wait for it
+        surfaces[key] = get_result(key, pending.pop(key))
+
+    elif key not in surfaces:
+        # Not registered in advance, load it right away
+        surfaces[key] = load_surface(path, rect)
+
+    return surfaces[key]
+
+
+def load_assets():
+    """Start loading all registered assets in the background."""
+    global executor
+    keys = [key for key in registered_assets
+            if key not in surfaces and key not in pending]
+
+    if not keys:
+        return
+
+    # Decoding and disk I/O mostly run without the GIL, so threads are
+    # enough to keep every core busy
+    executor = ThreadPoolExecutor(
+        max_workers=min(len(keys), os.cpu_count() or 1))
+
+    for key in keys:
+        pending[key] = executor.submit(load_surface, *key)
+
+
+def on_tick():
+    global executor
+    for key, future in list(pending.items()):
+        # Headless runs shouldn't depend on how fast assets load
+        if future.done() or app_.headless:
+            surfaces[key] = get_result(key, pending.pop(key))
+
+    if pending:
+        return
+
+    app_.unregister_tick_listener(on_tick)
+    app_.unregister_wakeup_provider(get_wakeup_time)
+
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+    InternalEvent.fire('assets_loaded')
+
+
+def get_wakeup_time():
+    # Keep polling at the tick rate while assets are loading
+    return 1 / TICKRATE
+
+
+@InternalEvent('load')
+def on_load(app):
+    global app_
+    app_ = app
+
+    load_assets()
+    app_.register_tick_listener(on_tick)
+    app_.register_wakeup_provider(get_wakeup_time)
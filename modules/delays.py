@@ -1,9 +1,28 @@
+from heapq import heapify, heappop, heappush
+from itertools import count
+
 from constants import TICKRATE
 from internal_events import InternalEvent
 
 
 tick_number = 0
+
+# Heap of (fires_at, sequence, delay) entries; cancelled delays are left in
+# place and skipped once they reach the top
 delays = []
+_sequence = count()
+_cancelled_count = 0
+
+
+def _schedule(delay):
+    heappush(delays, (delay.fires_at, next(_sequence), delay))
+
+
+def _discard_cancelled():
+    global _cancelled_count
+    while delays and not delays[0][2].running:
+        heappop(delays)
+        _cancelled_count -= 1
 
 
 class Delay:
@@ -15,27 +34,64 @@ class Delay:
         self.running = True
         self.fires_at = tick_number + seconds * TICKRATE
 
-        delays.append(self)
+        _schedule(self)
 
     def __call__(self):
         self.running = False
         self.callback(*self.args, **self.kwargs)
 
     def cancel(self):
-        if self.running:
-            delays.remove(self)
+        global _cancelled_count
+        if not self.running:
+            return
+
+        self.running = False
+        _cancelled_count += 1
+
+        # Don't let cancelled delays pile up in the heap
+        if _cancelled_count > len(delays) // 2:
+            delays[:] = [entry for entry in delays if entry[2].running]
+            heapify(delays)
+            _cancelled_count = 0
+
+
+class Repeat(Delay):
+    def __init__(self, seconds, callback, args=(), kwargs=None):
+        if seconds <= 0:
+            raise ValueError("Repeat interval should be positive")
+
+        self.interval = seconds * TICKRATE
+        super().__init__(seconds, callback, args, kwargs)
+
+    def __call__(self):
+        # Counted from the scheduled time rather than from now, so that
+        # late ticks don't make it drift
+        self.fires_at += self.interval
+        _schedule(self)
+
+        self.callback(*self.args, **self.kwargs)
 
 
 def on_tick():
     global tick_number
     tick_number += 1
 
-    for delay in list(delays):
-        if delay.fires_at <= tick_number:
-            delay()
-            delays.remove(delay)
+    _discard_cancelled()
+    while delays and delays[0][0] <= tick_number:
+        fires_at, sequence, delay = heappop(delays)
+        delay()
+        _discard_cancelled()
+
+
+def get_wakeup_time():
+    _discard_cancelled()
+    if not delays:
+        return None
+
+    return max(0, (delays[0][0] - tick_number) / TICKRATE)
 
 
 @InternalEvent('load')
 def on_load(app):
     app.register_tick_listener(on_tick)
+    app.register_wakeup_provider(get_wakeup_time)
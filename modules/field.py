@@ -1,70 +1,145 @@
+from collections import OrderedDict
 import os.path
 
-from pygame import PixelArray, Surface
-from pygame.locals import SRCALPHA
+from pygame import Surface
 
 from __main__ import get_resource
-from constants import FIELD_H_NODES, FIELD_W_NODES, NODE_H, NODE_W, PIC_DIR
+from constants import NODE_H, NODE_W, PIC_DIR
 from internal_events import InternalEvent
-from libs.olbmp import OLBitMap
+from modules.assets import get_image_size, get_surface, register_asset
+from modules.game import (
+    FIELD_H, FIELD_RECT, FIELD_W, camera, get_chunk_rect)
 
 
 FIELD_PIC = get_resource(os.path.join(PIC_DIR, "field.olbmp"))
 SHADOWS_PIC = get_resource(os.path.join(PIC_DIR, "shadows.olbmp"))
-FIELD_W = FIELD_W_NODES * NODE_W
-FIELD_H = FIELD_H_NODES * NODE_H
+
+# Field art is tiled over fields larger than it
+ART_W, ART_H = get_image_size(FIELD_PIC)
+TILE_W = min(FIELD_W, ART_W)
+TILE_H = min(FIELD_H, ART_H)
+TILE_RECT = (0, 0, TILE_W, TILE_H)
+SHADOWS_RECT = (0, 0, camera.rect.w, camera.rect.h)
+CHUNK_CACHE_SIZE = 32
 FIELD_COLOR = (0, 0, 0, 255)
+BACKGROUND_COLOR = (255, 255, 255)  # Seen through translucent field art
+PLACEHOLDER_COLOR = (168, 136, 106)
 DEBUG_GRID = False
 
+app_ = None
 field_image = None
 shadows_image = None
 field = None
 shadows = None
 
+register_asset(FIELD_PIC, TILE_RECT)
+register_asset(SHADOWS_PIC, SHADOWS_RECT)
+
 
 def load_resources():
     global field_image, shadows_image
-    field_image = OLBitMap(FIELD_PIC)
-    shadows_image = OLBitMap(SHADOWS_PIC)
+    field_image = get_surface(FIELD_PIC, TILE_RECT)
+    shadows_image = get_surface(SHADOWS_PIC, SHADOWS_RECT)
 
 
 class AreaWideImage:
     def __init__(self, image):
-        self._surface = Surface((FIELD_W, FIELD_H), SRCALPHA)
+        self._surface = None
         self._image = image
+        self._rect = None
 
     def render(self):
-        pix_arr = PixelArray(self._surface)
+        self._surface = self._image.copy()
+
+        # Only keep the part that isn't fully transparent
+        self._rect = self._surface.get_bounding_rect()
+        if self._rect.size != self._surface.get_size():
+            self._surface = self._surface.subsurface(self._rect).copy()
+
+    def draw(self, dest):
+        return dest.blit(self._surface, self._rect)
+
+
+class FieldChunks:
+    """Field image tiled over the whole field, rendered chunk by chunk as
+    chunks come into view.
+
+    Only CHUNK_CACHE_SIZE most recently drawn chunks are kept.
+    """
+    def __init__(self, image):
+        self._image = image
+        self._chunks = OrderedDict()
+
+    def clear(self):
+        self._chunks.clear()
 
-        for i in range(FIELD_H):
-            for j in range(FIELD_W):
-                pix_arr[j, i] = self._image[j, i]
+    def render_chunk(self, chunk):
+        rect = get_chunk_rect(chunk).clip(FIELD_RECT)
+        surface = Surface(rect.size).convert()
 
+        # Chunks are opaque, so they're blitted without blending later
+        surface.fill(BACKGROUND_COLOR)
+        for y in range(rect.top // TILE_H * TILE_H, rect.bottom, TILE_H):
+            for x in range(rect.left // TILE_W * TILE_W, rect.right, TILE_W):
+                surface.blit(self._image, (x - rect.x, y - rect.y))
+
+        # Chunks start on cell boundaries
         if DEBUG_GRID:
-            for node_i in range(FIELD_H_NODES):
-                for node_j in range(FIELD_W_NODES):
-                    for i in range(NODE_H):
-                        pix_arr[
-                            node_j * NODE_W, node_i * NODE_H + i] = FIELD_COLOR
+            for y in range(0, rect.h, NODE_H):
+                surface.fill(FIELD_COLOR, (0, y, rect.w, 1))
+
+            for x in range(0, rect.w, NODE_W):
+                surface.fill(FIELD_COLOR, (x, 0, 1, rect.h))
+
+        return surface
 
-                    for j in range(NODE_W):
-                        pix_arr[
-                            node_j * NODE_W + j, node_i * NODE_H] = FIELD_COLOR
+    def get_chunk(self, chunk):
+        surface = self._chunks.get(chunk)
+        if surface is not None:
+            self._chunks.move_to_end(chunk)
+            return surface
 
-        del pix_arr
+        surface = self._chunks[chunk] = self.render_chunk(chunk)
+        if len(self._chunks) > CHUNK_CACHE_SIZE:
+            self._chunks.popitem(last=False)
+
+        return surface
 
     def draw(self, dest):
-        dest.blit(self._surface, (0, 0))
+        """Draw chunks the camera sees."""
+        offset_x, offset_y = camera.get_offset()
+        rects = []
+        for chunk in camera.get_visible_chunks():
+            x, y = get_chunk_rect(chunk).topleft
+            rects.append(dest.blit(
+                self.get_chunk(chunk), (x + offset_x, y + offset_y)))
+
+        return rects
+
+
+def draw_placeholder(dest):
+    return dest.fill(PLACEHOLDER_COLOR, camera.to_screen(FIELD_RECT))
 
 
 @InternalEvent('load')
 def on_load(app):
+    global app_
+    app_ = app
+
+    # Shown until the real field is loaded in the background
+    app_.register_drawer('field', draw_placeholder, static=True)
+
+
+@InternalEvent('assets_loaded')
+def on_assets_loaded():
     load_resources()
 
     global field, shadows
-    field = AreaWideImage(field_image)
-    field.render()
-    app.register_drawer('field', field.draw)
+    field = FieldChunks(field_image)
+    app_.unregister_drawer('field', draw_placeholder)
+    app_.register_drawer('field', field.draw, static=True)
+
+    # Shadows are cast over the screen rather than the field
     shadows = AreaWideImage(shadows_image)
     shadows.render()
-    app.register_drawer('shadows', shadows.draw)
+    app_.register_drawer('shadows', shadows.draw, static=True)
@@ -1,14 +1,12 @@
 import os.path
-from random import choice, randint
-
-from pygame import PixelArray, Surface
-from pygame.locals import SRCALPHA
+from random import choice
 
 from __main__ import get_resource
 from constants import NODE_H, NODE_W, PIC_DIR
 from internal_events import InternalEvent
-from libs.olbmp import OLBitMap
-from modules.game import playground
+from libs.sprite_batch import SpriteBatch
+from modules.assets import get_surface, register_asset
+from modules.game import camera, get_chunk, playground
 
 
 APPLE_PIC = get_resource(os.path.join(PIC_DIR, "fruit_apple.olbmp"))
@@ -21,16 +19,28 @@ STRAWBERRY_PIC = get_resource(os.path.join(PIC_DIR, "fruit_strawberry.olbmp"))
 app_ = None
 images = {}
 fruit_classes = []
-fruits = []
+
+# Fruits on the field grouped by (x, y) cell
+fruits = {}
+
+# Fruits are drawn in batches by field chunk, only visible chunks are drawn
+fruit_batches = {}
+
+register_asset(APPLE_PIC)
+register_asset(APRICOT_PIC)
+register_asset(CHERRY_PIC)
+register_asset(KIWI_PIC)
+register_asset(PEAR_PIC)
+register_asset(STRAWBERRY_PIC)
 
 
 def load_resources():
-    images['apple'] = OLBitMap(APPLE_PIC)
-    images['apricot'] = OLBitMap(APRICOT_PIC)
-    images['cherry'] = OLBitMap(CHERRY_PIC)
-    images['kiwi'] = OLBitMap(KIWI_PIC)
-    images['pear'] = OLBitMap(PEAR_PIC)
-    images['strawberry'] = OLBitMap(STRAWBERRY_PIC)
+    images['apple'] = get_surface(APPLE_PIC)
+    images['apricot'] = get_surface(APRICOT_PIC)
+    images['cherry'] = get_surface(CHERRY_PIC)
+    images['kiwi'] = get_surface(KIWI_PIC)
+    images['pear'] = get_surface(PEAR_PIC)
+    images['strawberry'] = get_surface(STRAWBERRY_PIC)
 
 
 class FruitMeta(type):
@@ -51,22 +61,16 @@ class Fruit(metaclass=FruitMeta):
     abstract = True
 
     def __init__(self, x, y):
-        self._surface = Surface((NODE_W, NODE_H), SRCALPHA)
+        self._surface = None
         self._image = images[self.image_id]
         self.x = x
         self.y = y
 
-    def draw(self, dest):
-        dest.blit(self._surface, (self.x * NODE_W, self.y * NODE_H))
+    def get_sprite(self):
+        return self._surface, (self.x * NODE_W, self.y * NODE_H)
 
     def render(self):
-        pix_arr = PixelArray(self._surface)
-
-        for i in range(NODE_H):
-            for j in range(NODE_W):
-                pix_arr[j, i] = self._image[j, i]
-
-        del pix_arr
+        self._surface = self._image
 
 
 class Apple(Fruit):
@@ -97,55 +101,108 @@ class Strawberry(Fruit):
 def on_load(app):
     global app_
     app_ = app
+
+    app_.register_drawer('fruit', draw_fruits, bounds=get_fruit_rects)
+
+
+@InternalEvent('assets_loaded')
+def on_assets_loaded():
     load_resources()
 
 
+def get_fruit_rects():
+    offset = camera.get_offset()
+    rects = []
+    for chunk in camera.get_visible_chunks():
+        batch = fruit_batches.get(chunk)
+        if batch is not None:
+            rects.extend(batch.get_rects(offset))
+
+    return rects
+
+
+def draw_fruits(dest):
+    offset = camera.get_offset()
+    rects = []
+    for chunk in camera.get_visible_chunks():
+        batch = fruit_batches.get(chunk)
+        if batch is not None:
+            rects.extend(batch.draw(dest, offset))
+
+    return rects
+
+
 def spawn_fruit():
-    x = randint(playground.minx, playground.maxx)
-    y = randint(playground.miny, playground.maxy)
+    cell = playground.sample_free_cell()
+    if cell is None:
+        # Nowhere to put it
+        return
+
+    x, y = cell
+    playground.occupy(x, y)
 
     fruit_class = choice(fruit_classes)
 
     fruit = fruit_class(x, y)
     fruit.render()
 
-    fruits.append(fruit)
+    fruits.setdefault((x, y), []).append(fruit)
+
+    chunk = get_chunk(x, y)
+    if chunk not in fruit_batches:
+        fruit_batches[chunk] = SpriteBatch()
+
+    fruit_batches[chunk].add(fruit, *fruit.get_sprite())
+    app_.invalidate()
 
-    app_.register_drawer('fruit', fruit.draw)
+
+def remove_fruit(fruit):
+    chunk = get_chunk(fruit.x, fruit.y)
+    fruit_batches[chunk].remove(fruit)
+    if not fruit_batches[chunk]:
+        del fruit_batches[chunk]
+
+    app_.invalidate()
+    playground.release(fruit.x, fruit.y)
+
+    cell_fruits = fruits[fruit.x, fruit.y]
+    cell_fruits.remove(fruit)
+    if not cell_fruits:
+        del fruits[fruit.x, fruit.y]
 
 
 @InternalEvent('snake_step')
 def on_snake_step(snake):
-    for fruit in list(fruits):
-        if (fruit.x, fruit.y) == (snake.x, snake.y):
-            if fruit.increments > 0:
-                for i in range(fruit.increments):
-                    snake.increment()
-            else:
-                for i in range(abs(fruit.increments)):
-                    snake.decrement()
+    cell = int(snake.x), int(snake.y)
+    if cell not in fruits:
+        return
 
-            snake.render()
+    for fruit in fruits[cell]:
+        if fruit.increments > 0:
+            for i in range(fruit.increments):
+                snake.increment()
+        else:
+            for i in range(abs(fruit.increments)):
+                snake.decrement()
 
-            InternalEvent.fire('fruit_eaten', fruit=fruit)
+        # Handled once the tick is over rather than in the middle of the step
+        InternalEvent.fire_later('fruit_eaten', fruit=fruit)
 
 
 @InternalEvent('fruit_eaten')
 def on_fruit_eaten(fruit):
-    app_.unregister_drawer('fruit', fruit.draw)
-    fruits.remove(fruit)
-
+    remove_fruit(fruit)
     spawn_fruit()
 
 
-@InternalEvent('game_start')
-def on_game_start():
+@InternalEvent('snake_spawn')
+def on_snake_spawn(snake):
+    # Spawned only now so that the fruit doesn't land on the new snake
     spawn_fruit()
 
 
 @InternalEvent('game_end')
 def on_game_end():
-    for fruit in fruits:
-        app_.unregister_drawer('fruit', fruit.draw)
-
-    fruits[:] = []
+    for cell_fruits in list(fruits.values()):
+        for fruit in list(cell_fruits):
+            remove_fruit(fruit)
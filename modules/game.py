@@ -1,4 +1,28 @@
-from constants import FIELD_H_NODES, FIELD_W_NODES
+from array import array
+from random import randrange
+
+from pygame import Rect
+
+from constants import (
+    CHUNK_H_NODES, CHUNK_W_NODES, FIELD_H_NODES, FIELD_W_NODES, HEIGHT,
+    NODE_H, NODE_W, WIDTH)
+
+
+FIELD_W = FIELD_W_NODES * NODE_W
+FIELD_H = FIELD_H_NODES * NODE_H
+FIELD_RECT = (0, 0, FIELD_W, FIELD_H)
+CHUNK_W = CHUNK_W_NODES * NODE_W
+CHUNK_H = CHUNK_H_NODES * NODE_H
+
+
+def get_chunk(x, y):
+    """Return the (x, y) index of the chunk the cell belongs to."""
+    return x // CHUNK_W_NODES, y // CHUNK_H_NODES
+
+
+def get_chunk_rect(chunk):
+    x, y = chunk
+    return Rect(x * CHUNK_W, y * CHUNK_H, CHUNK_W, CHUNK_H)
 
 
 class Playground:
@@ -8,4 +32,119 @@ class Playground:
         self.miny = 0
         self.maxy = FIELD_H_NODES - 1
 
+        self.width = self.maxx - self.minx + 1
+        self.height = self.maxy - self.miny + 1
+
+        self.clear()
+
+    def clear(self):
+        size = self.width * self.height
+
+        # Number of things occupying every cell
+        self._counts = bytearray(size)
+
+        # Indexes of free cells packed together, plus where each cell sits
+        # in that array, so both sampling and updates are O(1)
+        self._free = array('I', range(size))
+        self._free_positions = array('I', range(size))
+
+    def contains(self, x, y):
+        return self.minx <= x <= self.maxx and self.miny <= y <= self.maxy
+
+    def _get_index(self, x, y):
+        return (y - self.miny) * self.width + (x - self.minx)
+
+    def occupy(self, x, y):
+        if not self.contains(x, y):
+            return
+
+        index = self._get_index(x, y)
+        if not self._counts[index]:
+            position = self._free_positions[index]
+            last = self._free[-1]
+            self._free[position] = last
+            self._free_positions[last] = position
+            self._free.pop()
+
+        self._counts[index] += 1
+
+    def release(self, x, y):
+        if not self.contains(x, y):
+            return
+
+        index = self._get_index(x, y)
+        if not self._counts[index]:
+            raise ValueError("Cell ({}, {}) is not occupied".format(x, y))
+
+        self._counts[index] -= 1
+        if not self._counts[index]:
+            self._free_positions[index] = len(self._free)
+            self._free.append(index)
+
+    def is_free(self, x, y):
+        return self.contains(x, y) and not self._counts[self._get_index(x, y)]
+
+    def get_free_count(self):
+        return len(self._free)
+
+    def get_occupied_count(self):
+        return self.width * self.height - len(self._free)
+
+    def sample_free_cell(self):
+        """Return random free (x, y) cell or None if the field is full."""
+        if not self._free:
+            return None
+
+        index = self._free[randrange(len(self._free))]
+        return (self.minx + index % self.width,
+                self.miny + index // self.width)
+
+
+class Camera:
+    """Part of the field shown on the screen, in field pixels.
+
+    The view starts in the top left corner of the screen. Fields larger
+    than the screen scroll, smaller ones stay where they are.
+    """
+    def __init__(self, width, height):
+        self.rect = Rect(0, 0, min(width, FIELD_W), min(height, FIELD_H))
+        self.scrolling = FIELD_W > width or FIELD_H > height
+        self._visible_chunks = None
+
+    def get_offset(self):
+        """Return what to add to field positions to get screen ones."""
+        return -self.rect.x, -self.rect.y
+
+    def to_screen(self, rect):
+        return Rect(rect).move(-self.rect.x, -self.rect.y)
+
+    def look_at(self, x, y):
+        """Center the view on the field pixel as far as the field allows.
+
+        Return True if the view has moved.
+        """
+        left = min(max(0, round(x - self.rect.w / 2)), FIELD_W - self.rect.w)
+        top = min(max(0, round(y - self.rect.h / 2)), FIELD_H - self.rect.h)
+        if (left, top) == self.rect.topleft:
+            return False
+
+        self.rect.topleft = left, top
+        self._visible_chunks = None
+        return True
+
+    def get_visible_chunks(self):
+        """Return (x, y) indexes of chunks the view overlaps."""
+        if self._visible_chunks is None:
+            left, top = self.rect.x // CHUNK_W, self.rect.y // CHUNK_H
+            right = (self.rect.right - 1) // CHUNK_W
+            bottom = (self.rect.bottom - 1) // CHUNK_H
+
+            self._visible_chunks = [
+                (x, y) for y in range(top, bottom + 1)
+                for x in range(left, right + 1)]
+
+        return self._visible_chunks
+
+
 playground = Playground()
+camera = Camera(WIDTH, HEIGHT)
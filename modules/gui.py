@@ -7,12 +7,16 @@ from constants import HEIGHT, WIDTH
 from internal_events import InternalEvent
 
 
+FONT_NAME = "Courier New"
 MENU_COLOR = (255, 255, 255, 100)
 BUTTON_COLOR = (253, 40, 40)
+BUTTON_DISABLED_COLOR = (160, 160, 160)
 BUTTON_CAPTION_COLOR = (255, 255, 255)
 BUTTON_WIDTH = 400
 BUTTON_HEIGHT = 100
 LABEL_COLOR = (0, 0, 0)
+START_BUTTON_CAPTION = "START"
+LOADING_CAPTION = "LOADING..."
 CREATED_BY_LABEL_X = 10
 CREATED_BY_LABEL_Y = HEIGHT - 15
 
@@ -25,6 +29,22 @@ _mouse_button_down_coords = None
 _made_by_label = None
 paused = False
 finished = True
+assets_loaded = False
+fonts = {}
+
+
+def invalidate():
+    # Let the app know it has to redraw even if it's idle
+    if app_ is not None:
+        app_.invalidate()
+
+
+def get_font(family, size, bold=False, italic=False):
+    key = family, size, bold, italic
+    if key not in fonts:
+        fonts[key] = SysFont(family, size, bold=bold, italic=italic)
+
+    return fonts[key]
 
 
 class Menu:
@@ -35,7 +55,7 @@ class Menu:
         self._surface.fill(MENU_COLOR)
 
     def draw(self, dest):
-        dest.blit(self._surface, (0, 0))
+        return dest.blit(self._surface, (0, 0))
 
 
 class Button:
@@ -59,8 +79,8 @@ class Button:
     def render(self):
         self._surface.fill(self.color)
 
-        font = SysFont("Courier New", self.text_size,
-                       bold=self.caption_bold, italic=self.caption_italic)
+        font = get_font(FONT_NAME, self.text_size,
+                        self.caption_bold, self.caption_italic)
 
         text = font.render(self.caption, True, Color(*self.caption_color))
 
@@ -69,9 +89,13 @@ class Button:
         x = max(0, w // 2 - tw // 2)
         y = max(0, h // 2 - th // 2)
         self._surface.blit(text, (x, y))
+        invalidate()
+
+    def get_rect(self):
+        return self._surface.get_rect(topleft=(self.x, self.y))
 
     def draw(self, dest):
-        dest.blit(self._surface, (self.x, self.y))
+        return dest.blit(self._surface, (self.x, self.y))
 
     def check_coords(self, pos):
         if not self.clickable:
@@ -101,14 +125,18 @@ class TextLabel:
         self._surface = None
 
     def render(self):
-        font = SysFont("Courier New", self.text_size,
-                       bold=self.caption_bold, italic=self.caption_italic)
+        font = get_font(FONT_NAME, self.text_size,
+                        self.caption_bold, self.caption_italic)
 
         text = font.render(self.caption, True, Color(*self.color))
         self._surface = text
+        invalidate()
+
+    def get_rect(self):
+        return self._surface.get_rect(topleft=(self.x, self.y))
 
     def draw(self, dest):
-        dest.blit(self._surface, (self.x, self.y))
+        return dest.blit(self._surface, (self.x, self.y))
 
 
 class StartButton(Button):
@@ -152,9 +180,11 @@ def on_key_down(e):
 def show_start_gui():
     app_.register_event_handler(MOUSEBUTTONDOWN, on_mouse_button_down)
     app_.register_event_handler(MOUSEBUTTONUP, on_mouse_button_up)
-    app_.register_drawer('menu', menu.draw)
-    app_.register_drawer('gui', start_button.draw)
-    start_button.clickable = True
+    app_.register_drawer('menu', menu.draw, static=True)
+    app_.register_drawer(
+        'gui', start_button.draw, bounds=start_button.get_rect)
+    start_button.clickable = assets_loaded
+    app_.set_idle(True)
 
 
 def hide_start_gui():
@@ -163,14 +193,17 @@ def hide_start_gui():
     app_.unregister_drawer('menu', menu.draw)
     app_.unregister_drawer('gui', start_button.draw)
     start_button.clickable = False
+    app_.set_idle(False)
 
 
 def show_pause_gui():
     app_.register_event_handler(MOUSEBUTTONDOWN, on_mouse_button_down)
     app_.register_event_handler(MOUSEBUTTONUP, on_mouse_button_up)
-    app_.register_drawer('menu', menu.draw)
-    app_.register_drawer('gui', resume_button.draw)
+    app_.register_drawer('menu', menu.draw, static=True)
+    app_.register_drawer(
+        'gui', resume_button.draw, bounds=resume_button.get_rect)
     resume_button.clickable = True
+    app_.set_idle(True)
 
 
 def hide_pause_gui():
@@ -179,6 +212,7 @@ def hide_pause_gui():
     app_.unregister_drawer('menu', menu.draw)
     app_.unregister_drawer('gui', resume_button.draw)
     resume_button.clickable = False
+    app_.set_idle(False)
 
 
 @InternalEvent('load')
@@ -189,14 +223,15 @@ def on_load(app):
     menu = Menu()
     menu.render()
 
+    # Disabled until the game assets finish loading
     start_button = StartButton(
         WIDTH // 2 - BUTTON_WIDTH // 2,
         HEIGHT // 2 - BUTTON_HEIGHT // 2,
         BUTTON_WIDTH,
         BUTTON_HEIGHT,
-        "START",
+        LOADING_CAPTION,
         48,
-        BUTTON_COLOR,
+        BUTTON_DISABLED_COLOR,
         BUTTON_CAPTION_COLOR
     )
     start_button.render()
@@ -219,12 +254,26 @@ def on_load(app):
 
     _made_by_label.render()
 
-    app_.register_drawer('gui', _made_by_label.draw)
+    app_.register_drawer(
+        'gui', _made_by_label.draw, bounds=_made_by_label.get_rect)
     app_.register_event_handler(KEYDOWN, on_key_down)
 
     show_start_gui()
 
 
+@InternalEvent('assets_loaded')
+def on_assets_loaded():
+    global assets_loaded
+    assets_loaded = True
+
+    start_button.caption = START_BUTTON_CAPTION
+    start_button.color = BUTTON_COLOR
+    start_button.render()
+
+    if finished:
+        start_button.clickable = True
+
+
 @InternalEvent('game_start')
 def on_game_start():
     global finished
@@ -1,4 +1,4 @@
-from modules.delays import Delay
+from modules.delays import Repeat
 from modules.gui import TextLabel
 from internal_events import InternalEvent
 
@@ -21,14 +21,12 @@ time_delay = None
 
 
 def update_time():
-    global time_, time_delay
+    global time_
     time_ += 1
 
     time_label.caption = TIME_LABEL_CAPTION.format(seconds=time_)
     time_label.render()
 
-    time_delay = Delay(1, update_time)
-
 
 @InternalEvent('load')
 def on_load(app):
@@ -48,8 +46,10 @@ def on_load(app):
 
     time_label.render()
 
-    app_.register_drawer('score', highscore_label.draw)
-    app_.register_drawer('score', time_label.draw)
+    app_.register_drawer(
+        'score', highscore_label.draw, bounds=highscore_label.get_rect)
+    app_.register_drawer(
+        'score', time_label.draw, bounds=time_label.get_rect)
 
 
 @InternalEvent('fruit_eaten')
@@ -71,6 +71,7 @@ def on_game_end():
     highscore_label.render()
 
     update_time()
+    time_delay = Repeat(1, update_time)
 
 
 @InternalEvent('game_end')
@@ -1,13 +1,17 @@
+from collections import OrderedDict, deque
+from itertools import islice
 import os.path
 
-from pygame import PixelArray, Surface
-from pygame.locals import K_DOWN, K_LEFT, K_RIGHT, K_UP, KEYDOWN, SRCALPHA
+from pygame import Rect, Surface
+from pygame.locals import (
+    BLEND_RGBA_MAX, K_DOWN, K_LEFT, K_RIGHT, K_UP, KEYDOWN, SRCALPHA)
 
 from __main__ import get_resource
 from constants import NODE_H, NODE_W, PIC_DIR
 from internal_events import InternalEvent
-from libs.olbmp import OLBitMap
-from modules.game import playground
+from modules.assets import get_surface, register_asset
+from modules.game import (
+    CHUNK_H, CHUNK_W, camera, get_chunk, get_chunk_rect, playground)
 
 
 SNAKE_PIC = get_resource(os.path.join(PIC_DIR, "snake.olbmp"))
@@ -19,15 +23,79 @@ INIT_Y = 10
 INIT_LENGTH = 3
 BORDER_COLOR = (0, 0, 0, 255)
 DRAW_BORDER = False
+SMOOTH_MOVEMENT = True
+BODY_CHUNK_CACHE_SIZE = 16
+TRANSPARENT = (0, 0, 0, 0)
+
+# Bits of the mask telling which sides a node has neighbors on
+NEIGHBOR_UP = 1
+NEIGHBOR_RIGHT = 2
+NEIGHBOR_DOWN = 4
+NEIGHBOR_LEFT = 8
+NEIGHBOR_MASKS = {
+    (0, -1): NEIGHBOR_UP,
+    (1, 0): NEIGHBOR_RIGHT,
+    (0, 1): NEIGHBOR_DOWN,
+    (-1, 0): NEIGHBOR_LEFT,
+}
 
 app_ = None
 snake_image = None
 snake = None
 
+# Node textures shared by all nodes, indexed by neighbor mask
+node_textures = []
+
+register_asset(SNAKE_PIC)
+
 
 def load_resources():
     global snake_image
-    snake_image = OLBitMap(SNAKE_PIC)
+    snake_image = get_surface(SNAKE_PIC)
+
+    if DRAW_BORDER:
+        node_textures[:] = [render_node_texture(neighbors)
+                            for neighbors in range(16)]
+    else:
+        node_textures[:] = [snake_image] * 16
+
+
+def render_node_texture(neighbors):
+    """Render a node with borders on the sides that have no neighbors."""
+    surface = snake_image.copy()
+
+    if not neighbors & NEIGHBOR_UP:
+        surface.fill(BORDER_COLOR, (0, 0, NODE_W, 1))
+
+    if not neighbors & NEIGHBOR_RIGHT:
+        surface.fill(BORDER_COLOR, (NODE_W - 1, 0, 1, NODE_H))
+
+    if not neighbors & NEIGHBOR_DOWN:
+        surface.fill(BORDER_COLOR, (0, NODE_H - 1, NODE_W, 1))
+
+    if not neighbors & NEIGHBOR_LEFT:
+        surface.fill(BORDER_COLOR, (0, 0, 1, NODE_H))
+
+    return surface
+
+
+def get_cell_rect(cell):
+    x, y = cell
+    return Rect(x * NODE_W, y * NODE_H, NODE_W, NODE_H)
+
+
+def interpolate(src, dest, progress):
+    (src_x, src_y), (x, y) = src, dest
+    return src_x + (x - src_x) * progress, src_y + (y - src_y) * progress
+
+
+def get_neighbors(cell, *neighbor_cells):
+    x, y = cell
+    neighbors = 0
+    for neighbor_x, neighbor_y in neighbor_cells:
+        neighbors |= NEIGHBOR_MASKS.get((neighbor_x - x, neighbor_y - y), 0)
+
+    return neighbors
 
 
 class Direction:
@@ -39,58 +107,54 @@ class Direction:
 
 
 class SnakeNode:
-    def __init__(self, offset_x, offset_y):
-        self.x = offset_x
-        self.y = offset_y
-        self._surface = Surface((NODE_W, NODE_H), SRCALPHA)
-
-    def draw(self, dest, offset_x, offset_y):
-        dest.blit(self._surface, (NODE_W * offset_x, NODE_H * offset_y))
+    def __init__(self):
+        self._surface = None
 
-    def render(self, next_node):
-        pix_arr = PixelArray(self._surface)
+    def get_sprite(self, x, y):
+        return self._surface, (round(NODE_W * x), round(NODE_H * y))
 
-        for i in range(NODE_H):
-            for j in range(NODE_W):
-                pix_arr[j, i] = snake_image[j, i]
+    def render(self, neighbors):
+        """Pick the texture given the NEIGHBOR_* mask of adjacent nodes."""
+        self._surface = node_textures[neighbors]
 
-        if DRAW_BORDER:
-            # Top border
-            if self.y != 1 and ((not next_node) or next_node.y != -1):
-                for j in range(NODE_W):
-                    pix_arr[j, 0] = BORDER_COLOR
 
-            # Right border
-            if self.x != -1 and ((not next_node) or next_node.x != 1):
-                for i in range(NODE_H):
-                    pix_arr[NODE_W - 1, i] = BORDER_COLOR
-
-            # Bottom border
-            if self.y != -1 and ((not next_node) or next_node.y != 1):
-                for j in range(NODE_W):
-                    pix_arr[j, NODE_H - 1] = BORDER_COLOR
-
-            # Left border
-            if self.x != 1 and ((not next_node) or next_node.x != -1):
-                for i in range(NODE_H):
-                    pix_arr[0, i] = BORDER_COLOR
-
-        del pix_arr
-
-
-class Snake(list):
+class Snake:
     def __init__(self, x, y):
-        super().__init__()
-
         self.active = True
         self.x = x
         self.y = y
+        self._prev_x = x
+        self._prev_y = y
         self._direction = Direction.RIGHT
         self._speed = DEFAULT_SPEED
-        self._surface = Surface((NODE_W, NODE_H), SRCALPHA)
+
+        # Absolute cells from head to tail, the head cell is the one the
+        # snake is currently moving into
+        self._cells = deque()
+        self._occupied = {}
+        self._nodes = deque()
+
+        # Cell the tail has just left, None if it didn't move since the
+        # last change of length
+        self._last_tail = None
+
+        # Every node but the head, painted in place cell by cell as the
+        # snake changes, so drawing it doesn't depend on the snake length.
+        # Textures are kept by cell and cells by field chunk; surfaces are
+        # only kept for BODY_CHUNK_CACHE_SIZE most recently drawn chunks
+        # and repainted from the cells when they come back into view
+        self._body_chunks = OrderedDict()
+        self._chunk_cells = {}
+        self._body_cells = {}
 
         self.next_direction = Direction.RIGHT
 
+    def __len__(self):
+        return len(self._cells)
+
+    def __iter__(self):
+        return iter(self._cells)
+
     def get_speed(self):
         return self._speed
 
@@ -99,18 +163,31 @@ class Snake(list):
 
     speed = property(get_speed, set_speed)
 
+    def _occupy(self, cell):
+        self._occupied[cell] = self._occupied.get(cell, 0) + 1
+        playground.occupy(*cell)
+
+    def _release(self, cell):
+        count = self._occupied[cell] - 1
+        if count:
+            self._occupied[cell] = count
+        else:
+            del self._occupied[cell]
+
+        playground.release(*cell)
+
+    def clear(self):
+        """Remove all nodes, freeing their playground cells."""
+        while self:
+            self.decrement()
+
     def check_collision(self):
         if not self:
             return False
 
         # Self-collision
-        x, y = self.x, self.y
-        for node in self[1:]:
-            x += node.x
-            y += node.y
-
-            if x == self.x and y == self.y:
-                return True
+        if self._occupied[self._cells[0]] > 1:
+            return True
 
         # Collision with the field
         x, y = self.x, self.y
@@ -122,48 +199,239 @@ class Snake(list):
 
         return False
 
+    def _get_body_chunk(self, chunk):
+        """Return the body surface of the chunk, None if it's empty."""
+        surface = self._body_chunks.get(chunk)
+        if surface is not None:
+            self._body_chunks.move_to_end(chunk)
+            return surface
+
+        cells = self._chunk_cells.get(chunk)
+        if cells is None:
+            return None
+
+        surface = self._body_chunks[chunk] = Surface(
+            (CHUNK_W, CHUNK_H), SRCALPHA)
+
+        chunk_x, chunk_y = get_chunk_rect(chunk).topleft
+        for cell in cells:
+            x, y = get_cell_rect(cell).topleft
+            surface.blit(
+                self._body_cells[cell], (x - chunk_x, y - chunk_y),
+                special_flags=BLEND_RGBA_MAX)
+
+        if len(self._body_chunks) > BODY_CHUNK_CACHE_SIZE:
+            self._body_chunks.popitem(last=False)
+
+        return surface
+
+    def draw_body(self, dest):
+        offset_x, offset_y = camera.get_offset()
+        rects = []
+        for chunk in camera.get_visible_chunks():
+            surface = self._get_body_chunk(chunk)
+            if surface is not None:
+                x, y = get_chunk_rect(chunk).topleft
+                rects.append(dest.blit(surface, (x + offset_x, y + offset_y)))
+
+        return rects
+
+    def _get_sprites(self):
+        """Return the head, and the tail while it moves, as (surface,
+        screen position) pairs the camera can see."""
+        if not self:
+            return []
+
+        # The tail slides into its own cell, the body stays where it is
+        sprites = []
+        if SMOOTH_MOVEMENT and len(self) > 1 and self._last_tail is not None:
+            sprites.append(self._nodes[-1].get_sprite(*interpolate(
+                self._last_tail, self._cells[-1], self._get_progress())))
+
+        sprites.append(self._nodes[0].get_sprite(*self.get_head_position()))
+
+        offset_x, offset_y = camera.get_offset()
+        return [(surface, (x + offset_x, y + offset_y))
+                for surface, (x, y) in sprites
+                if camera.rect.colliderect(x, y, NODE_W, NODE_H)]
+
+    def get_rects(self):
+        return [surface.get_rect(topleft=pos)
+                for surface, pos in self._get_sprites()]
+
     def draw(self, dest):
-        x, y = int(self.x), int(self.y)
-        if self._direction == Direction.DOWN:
-            if self.y - y > DISP_PRECISION:
-                y += 1
+        """Draw the head, and the tail while it moves, over the body."""
+        return dest.blits(self._get_sprites())
+
+    def _get_progress(self):
+        """Return how far into the current step the snake is displayed."""
+        # Head position between the last two ticks
+        alpha = app_.interpolation
+        x = self._prev_x + (self.x - self._prev_x) * alpha
+        y = self._prev_y + (self.y - self._prev_y) * alpha
+
+        head_x, head_y = self._cells[0]
+        return max(0, 1 - abs(head_x - x) - abs(head_y - y))
+
+    def get_head_position(self):
+        """Return the (x, y) cell the head is displayed in, fractional while
+        it slides out of the cell of the node behind it."""
+        if not SMOOTH_MOVEMENT:
+            x, y = int(self.x), int(self.y)
+            if self._direction == Direction.DOWN:
+                if self.y - y > DISP_PRECISION:
+                    y += 1
+
+            elif self._direction == Direction.RIGHT:
+                if self.x - x > DISP_PRECISION:
+                    x += 1
+
+            return x, y
+
+        if len(self) > 1:
+            head_src = self._cells[1]
+        else:
+            head_src = self._last_tail or self._cells[0]
 
-        elif self._direction == Direction.RIGHT:
-            if self.x - x > DISP_PRECISION:
-                x += 1
+        return interpolate(head_src, self._cells[0], self._get_progress())
+
+    def update_camera(self):
+        """Keep the head in the middle of the view."""
+        if not self:
+            return
+
+        x, y = self.get_head_position()
+        left, top = camera.rect.topleft
+        if camera.look_at((x + 0.5) * NODE_W, (y + 0.5) * NODE_H):
+            app_.scroll_background(
+                'field', left - camera.rect.x, top - camera.rect.y)
+
+    def _paint_cell(self, cell, node=None, invalidate=True):
+        """Replace the cell on the body surface with the node texture, or
+        clear it if the node is None."""
+        # Cells out of the field are never seen
+        if not playground.contains(*cell):
+            return
 
-        for node in self:
-            x += node.x
-            y += node.y
+        chunk = get_chunk(*cell)
+        chunk_x, chunk_y = get_chunk_rect(chunk).topleft
+        rect = get_cell_rect(cell)
 
-            node.draw(dest, x, y)
+        # Chunks out of the cache get repainted when they're drawn next
+        surface = self._body_chunks.get(chunk)
+
+        if node is None:
+            if cell not in self._body_cells:
+                return
+
+            del self._body_cells[cell]
+            cells = self._chunk_cells[chunk]
+            cells.remove(cell)
+            if not cells:
+                del self._chunk_cells[chunk]
+                self._body_chunks.pop(chunk, None)
+
+            elif surface is not None:
+                surface.fill(TRANSPARENT, rect.move(-chunk_x, -chunk_y))
+
+        else:
+            texture, (x, y) = node.get_sprite(*cell)
+            self._body_cells[cell] = texture
+            self._chunk_cells.setdefault(chunk, set()).add(cell)
+
+            if surface is not None:
+                surface.fill(TRANSPARENT, rect.move(-chunk_x, -chunk_y))
+
+                # Copy texture pixels as they are instead of blending them
+                # with the transparent cell
+                surface.blit(
+                    texture, (x - chunk_x, y - chunk_y),
+                    special_flags=BLEND_RGBA_MAX)
+
+        if invalidate and app_ is not None:
+            app_.invalidate_rect('snake', camera.to_screen(rect))
+
+    def _clear_cell(self, cell):
+        """Clear a cell a node has left, unless another body node is
+        still in it."""
+        if cell in self._occupied:
+            nodes = islice(zip(self._nodes, self._cells), 1, None)
+            for node, node_cell in nodes:
+                if node_cell == cell:
+                    self._paint_cell(cell, node)
+                    return
+
+        self._paint_cell(cell)
 
     def render(self):
-        for i in range(len(self)):
-            if i + 1 < len(self):
-                next_node = self[i + 1]
-            else:
-                next_node = None
+        cells = list(self._cells)
+        for i, node in enumerate(self._nodes):
+            node.render(get_neighbors(
+                cells[i], *cells[max(0, i - 1):i], *cells[i + 1:i + 2]))
 
-            self[i].render(next_node)
+        self._body_chunks.clear()
+        self._chunk_cells.clear()
+        self._body_cells.clear()
+        for node, cell in islice(zip(self._nodes, cells), 1, None):
+            self._paint_cell(cell, node, invalidate=False)
+
+        if app_ is not None:
+            app_.invalidate_rect('snake', camera.to_screen(camera.rect))
+
+    def _render_nodes(self, *indexes):
+        """Only render nodes at the given indexes, negative ones included.
+
+        The head isn't painted on the body surface, it's drawn on its own.
+        """
+        length = len(self)
+        for i in set(i % length for i in indexes if -length <= i < length):
+            neighbor_cells = []
+            if i > 0:
+                neighbor_cells.append(self._cells[i - 1])
+
+            if i < length - 1:
+                neighbor_cells.append(self._cells[i + 1])
+
+            self._nodes[i].render(
+                get_neighbors(self._cells[i], *neighbor_cells))
+
+            if i > 0:
+                self._paint_cell(self._cells[i], self._nodes[i])
 
     def increment(self):
         if not self:
-            x, y = 0, 0
+            cell = int(self.x), int(self.y)
+        elif len(self) == 1:
+            x, y = self._cells[-1]
+            cell = x - 1, y
         else:
-            x, y = self[-1].x, self[-1].y
-            if (x, y) == (0, 0):
-                x, y = -1, 0
+            x, y = self._cells[-1]
+            prev_x, prev_y = self._cells[-2]
+            cell = 2 * x - prev_x, 2 * y - prev_y
+
+        self._cells.append(cell)
+        self._occupy(cell)
+        self._nodes.append(SnakeNode())
+        self._last_tail = None
 
-        self.append(SnakeNode(x, y))
+        self._render_nodes(-2, -1)
 
     def decrement(self):
         if not self:
             raise ValueError("Empty snake!")
 
-        self.pop()
+        cell = self._cells.pop()
+        self._release(cell)
+        self._nodes.pop()
+        self._clear_cell(cell)
+        self._last_tail = None
+
+        if self:
+            self._render_nodes(-1)
 
     def tick(self):
+        self._prev_x, self._prev_y = self.x, self.y
+
         if not self.active:
             return
 
@@ -180,26 +448,28 @@ class Snake(list):
                 InternalEvent.fire('game_end')
                 return
 
-            for i in range(len(self) - 1, 0, -1):
-                self[i].x = self[i - 1].x
-                self[i].y = self[i - 1].y
-
-                if (self[i].x, self[i].y) == (0, 0):
-                    self[i].x = {
-                        Direction.RIGHT: -1,
-                        Direction.LEFT: 1,
-                    }.get(self._direction, 0)
-
-                    self[i].y = {
-                        Direction.UP: 1,
-                        Direction.DOWN: -1,
-                    }.get(self._direction, 0)
+            if self:
+                dx, dy = {
+                    Direction.UP: (0, -1),
+                    Direction.RIGHT: (1, 0),
+                    Direction.DOWN: (0, 1),
+                    Direction.LEFT: (-1, 0),
+                }.get(self._direction, (0, 0))
+
+                x, y = self._cells[0]
+                self._cells.appendleft((x + dx, y + dy))
+                self._occupy(self._cells[0])
+                self._last_tail = self._cells.pop()
+                self._release(self._last_tail)
+                self._clear_cell(self._last_tail)
+
+                # Nodes move along with their cells, so only the ones
+                # around the ends have new neighbors
+                self._nodes.rotate(1)
+                self._render_nodes(0, 1, -1)
 
             InternalEvent.fire('snake_step', snake=self)
 
-            if DRAW_BORDER:
-                self.render()
-
         # Displacement
         if self._direction == Direction.UP:
             self.y -= self._speed
@@ -232,6 +502,10 @@ class Snake(list):
 def on_load(app):
     global app_
     app_ = app
+
+
+@InternalEvent('assets_loaded')
+def on_assets_loaded():
     load_resources()
 
 
@@ -239,19 +513,31 @@ def on_load(app):
 def on_game_start():
     global snake
     if snake is not None:
+        app_.unregister_drawer('snake', snake.draw_body)
         app_.unregister_drawer('snake', snake.draw)
         app_.unregister_tick_listener(snake.tick)
         app_.unregister_event_handler(KEYDOWN, snake.on_key_down)
+        if camera.scrolling:
+            app_.unregister_frame_listener(snake.update_camera)
+
+        snake.clear()
 
     snake = Snake(INIT_X, INIT_Y)
     for i in range(INIT_LENGTH):
         snake.increment()
 
     snake.render()
-    app_.register_drawer('snake', snake.draw)
+    app_.register_drawer('snake', snake.draw_body, static=True)
+    app_.register_drawer('snake', snake.draw, bounds=snake.get_rects)
     app_.register_tick_listener(snake.tick)
     app_.register_event_handler(KEYDOWN, snake.on_key_down)
 
+    # Fields larger than the screen scroll along with the head
+    if camera.scrolling:
+        app_.register_frame_listener(snake.update_camera)
+
+    InternalEvent.fire('snake_spawn', snake=snake)
+
 
 @InternalEvent('game_pause')
 def on_game_pause():
@@ -0,0 +1,152 @@
+from collections import deque
+from time import perf_counter
+
+import pygame
+
+
+WINDOW = 500
+PERCENTILES = (50, 95, 99)
+DUMP_INTERVAL = 10.0
+OVERLAY_INTERVAL = 0.5
+OVERLAY_LINES = 15
+OVERLAY_POS = (10, 10)
+OVERLAY_FONT_NAME = "Courier New"
+OVERLAY_FONT_SIZE = 14
+OVERLAY_COLOR = (255, 255, 255)
+OVERLAY_BG_COLOR = (0, 0, 0, 180)
+
+
+def get_name(func):
+    module = getattr(func, '__module__', None)
+    name = getattr(func, '__qualname__', None) or repr(func)
+    if module is None:
+        return name
+
+    return "{}.{}".format(module, name)
+
+
+def get_percentile(sorted_samples, percent):
+    index = round((len(sorted_samples) - 1) * percent / 100)
+    return sorted_samples[index]
+
+
+class Profiler:
+    """Keep timings of the last WINDOW calls to every profiled function."""
+    def __init__(self, log_path=None):
+        self._log_path = log_path
+        self._samples = {}
+        self._names = {}
+        self._last_dump = perf_counter()
+
+        self.overlay = False
+        self._overlay_font = None
+        self._overlay_surface = None
+        self._overlay_rendered_at = 0
+
+    def call(self, category, func, *args, **kwargs):
+        """Call func, adding the time it took to the samples of func."""
+        key = category, func
+        if key not in self._names:
+            self._names[key] = "{} {}".format(category, get_name(func))
+
+        started_at = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.add_sample(self._names[key], perf_counter() - started_at)
+
+    def add_sample(self, name, duration):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=WINDOW)
+
+        samples.append(duration)
+
+    def get_stats(self):
+        """Return (name, samples count, percentiles..., max) tuples.
+
+        The slowest functions by the 95th percentile go first.
+        """
+        stats = []
+        for name, samples in self._samples.items():
+            samples = sorted(samples)
+            stats.append((name, len(samples)) + tuple(
+                get_percentile(samples, percent) for percent in PERCENTILES
+            ) + (samples[-1], ))
+
+        stats.sort(key=lambda row: row[3], reverse=True)
+        return stats
+
+    def format_stats(self, limit=None):
+        lines = ["{:>7} {:>7} {:>7} {:>7}  {}".format(
+            *("p{}".format(percent) for percent in PERCENTILES), "max",
+            "name (ms, last {} calls)".format(WINDOW))]
+
+        for name, count, *timings in self.get_stats()[:limit]:
+            lines.append("{:7.3f} {:7.3f} {:7.3f} {:7.3f}  {}".format(
+                *(timing * 1000 for timing in timings), name))
+
+        return lines
+
+    def dump(self):
+        if self._log_path is None:
+            return
+
+        with open(self._log_path, 'a') as f:
+            f.write("\n".join(self.format_stats()) + "\n\n")
+
+        self._last_dump = perf_counter()
+
+    def update(self):
+        """Dump stats periodically and keep the overlay up to date.
+
+        Return True if the overlay has changed.
+        """
+        now = perf_counter()
+        if now - self._last_dump >= DUMP_INTERVAL:
+            self.dump()
+
+        if not self.overlay:
+            return False
+
+        if now - self._overlay_rendered_at < OVERLAY_INTERVAL:
+            return False
+
+        self.render_overlay()
+        self._overlay_rendered_at = now
+        return True
+
+    def render_overlay(self):
+        # Looking the font up is slow, it's only done once
+        if self._overlay_font is None:
+            self._overlay_font = pygame.font.SysFont(
+                OVERLAY_FONT_NAME, OVERLAY_FONT_SIZE)
+
+        font = self._overlay_font
+        lines = [font.render(line, True, OVERLAY_COLOR)
+                 for line in self.format_stats(OVERLAY_LINES)]
+
+        width = max(line.get_width() for line in lines)
+        height = sum(line.get_height() for line in lines)
+
+        self._overlay_surface = pygame.Surface(
+            (width, height), pygame.SRCALPHA)
+
+        self._overlay_surface.fill(OVERLAY_BG_COLOR)
+
+        y = 0
+        for line in lines:
+            self._overlay_surface.blit(line, (0, y))
+            y += line.get_height()
+
+    def get_rect(self):
+        if self._overlay_surface is None:
+            return []
+
+        return self._overlay_surface.get_rect(topleft=OVERLAY_POS)
+
+    def draw(self, dest):
+        if self._overlay_surface is None:
+            return []
+
+        return dest.blit(self._overlay_surface, OVERLAY_POS)
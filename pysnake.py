@@ -1,27 +1,35 @@
+from argparse import ArgumentParser
 import os
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 import sys
+import time
 
 import pygame
 from pygame.display import set_caption, set_icon
 from pygame.locals import *
-pygame.init()
 
 from constants import HEIGHT, TICKRATE, WIDTH
 from internal_events import InternalEvent
+from profiler import Profiler
 
 
 __version__ = "1.0"
 __author__ = "Kirill Mysnik"
 
-sys.stderr = open('stderr.log', 'w')
-sys.stdout = open('stdout.log', 'w')
-
 WINDOW_TITLE = "PySnake v{} by {}".format(__version__, __author__)
 RESOLUTION =  WIDTH, HEIGHT
 BG_COLOR = pygame.Color('#FFFFFF')
+DIRTY_RENDERING = True
+MAX_DIRTY_RATIO = 0.5
+IDLE_TIMEOUT = 1.0
+MAX_FRAMERATE = 144  # 0 to draw as fast as possible
+MAX_CATCHUP_TICKS = 5
+TICK_LENGTH = 1000 / TICKRATE
+PROFILE_LOG = 'profile.log'
+PROFILER_OVERLAY_KEY = K_F3
 
 render_order = []
+layer_indexes = {}
 
 
 def get_resource(path):
@@ -30,17 +38,128 @@ def get_resource(path):
     return path
 
 
+def collect_rects(rects, result):
+    """Add rects returned by a drawer to the result list.
+
+    Return False if the drawer didn't report what it touched.
+    """
+    if rects is None:
+        return False
+
+    if isinstance(rects, Rect):
+        result.append(rects)
+    else:
+        result.extend(rects)
+
+    return True
+
+
+def get_area(rects):
+    return sum(rect.w * rect.h for rect in rects)
+
+
+def merge_rects(rects):
+    """Return non-overlapping rects covering all of the given ones."""
+    merged = []
+    for rect in set(map(tuple, rects)):
+        rect = Rect(rect)
+        if not rect:
+            continue
+
+        index = rect.collidelist(merged)
+        while index != -1:
+            rect.union_ip(merged.pop(index))
+            index = rect.collidelist(merged)
+
+        merged.append(rect)
+
+    return merged
+
+
 with open(get_resource(os.path.join("resource", "render.txt"))) as f:
     for line in f:
         line = line.strip()
         if not line:
             continue
 
+        layer_indexes[line] = len(render_order)
         render_order.append(line)
 
 
+def parse_args(argv):
+    parser = ArgumentParser(description=WINDOW_TITLE)
+    parser.add_argument(
+        '--headless', action='store_true',
+        help="run the game without a window, as fast as possible")
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="time tick listeners, drawers and event handlers, writing "
+             "stats to {} (F3 toggles the overlay)".format(PROFILE_LOG))
+
+    parser.add_argument(
+        '--script', metavar='FILE',
+        help="read input events from FILE (headless mode only)")
+
+    parser.add_argument(
+        '--ticks', type=int, metavar='N',
+        help="quit after N ticks (headless mode only)")
+
+    args = parser.parse_args(argv)
+    if not args.headless and (args.script or args.ticks is not None):
+        parser.error("--script and --ticks require --headless")
+
+    return args
+
+
+def parse_input_script(f):
+    """Parse lines of an input script into (tick, events) pairs.
+
+    Each line is one of:
+        <tick> key <key name>
+        <tick> click <x> <y>
+        <tick> quit
+    Empty lines and lines starting with # are skipped.
+    """
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            tick, action, *params = line.split()
+            tick = int(tick)
+
+            if action == 'key' and len(params) == 1:
+                key = pygame.key.key_code(params[0])
+                events = [
+                    pygame.event.Event(KEYDOWN, key=key, mod=0, unicode=''),
+                    pygame.event.Event(KEYUP, key=key, mod=0),
+                ]
+
+            elif action == 'click' and len(params) == 2:
+                pos = int(params[0]), int(params[1])
+                events = [
+                    pygame.event.Event(MOUSEBUTTONDOWN, pos=pos, button=1),
+                    pygame.event.Event(MOUSEBUTTONUP, pos=pos, button=1),
+                ]
+
+            elif action == 'quit' and not params:
+                events = [pygame.event.Event(QUIT)]
+
+            else:
+                raise ValueError("unknown action '{}'".format(line))
+
+        except ValueError as e:
+            raise ValueError(
+                "Input script line {}: {}".format(line_number, e)) from e
+
+        yield tick, events
+
+
 class MainApp:
-    def __init__(self, argv):
+    def __init__(self, argv, headless=False):
+        self.headless = headless
         self._fullscreen = False
         self._screen = pygame.display.set_mode(RESOLUTION)
         self._clock = pygame.time.Clock()
@@ -49,7 +168,46 @@ class MainApp:
         self._event_handlers = {}
         self._event_proxies = []
         self._tick_listeners = []
-        self._drawers = []
+        self._frame_listeners = []
+        self._wakeup_providers = []
+
+        # Events to be handled right before the given tick number
+        self.tick_number = 0
+        self._scheduled_events = {}
+
+        # One ordered dict per render.txt layer, mapping drawers to their
+        # static flag
+        self._layers = [{} for id_ in render_order]
+
+        # Callables telling where non-static drawers are going to draw
+        self._drawer_bounds = {}
+
+        # Leading static drawers are flattened into a single opaque surface
+        self._background = None
+        self._baked_layer = -1
+
+        # Surface the background is rendered to, kept between renders so
+        # re-baking it doesn't allocate a new one
+        self._background_surface = None
+
+        # Dirty rendering state: rects drawn by non-static drawers during
+        # the previous frame, they're restored from the background first
+        self.dirty_rendering = DIRTY_RENDERING
+        self._drawn_rects = []
+        self._invalid_rects = []
+        self._full_redraw = True
+
+        # While idle, frames are only drawn after something invalidated them
+        self._idle = False
+        self._changed = True
+        self._last_tick_time = 0
+
+        # Profiler instance if profiling is enabled
+        self.profiler = None
+
+        # Part of the next tick that has already passed, in range [0, 1];
+        # drawers use it to interpolate between the last two ticks
+        self.interpolation = 0
 
     def register_event_handler(self, e_type, handler):
         if e_type not in self._event_handlers:
@@ -83,15 +241,197 @@ class MainApp:
     def unregister_tick_listener(self, listener):
         self._tick_listeners.remove(listener)
 
-    def register_drawer(self, id_, drawer):
-        if (id_, drawer) in self._drawers:
+    def register_frame_listener(self, listener):
+        """Register a callable run before every frame, once interpolation
+        for the frame is known."""
+        if listener in self._frame_listeners:
+            raise ValueError("Listener is already registered")
+
+        self._frame_listeners.append(listener)
+
+    def unregister_frame_listener(self, listener):
+        self._frame_listeners.remove(listener)
+
+    def register_wakeup_provider(self, provider):
+        """Register a callable telling when ticks are needed again.
+
+        While idle, the loop sleeps until an event arrives or until the
+        earliest number of seconds returned by providers passes. Providers
+        return None if they don't need to be woken up.
+        """
+        if provider in self._wakeup_providers:
+            raise ValueError("Provider is already registered")
+
+        self._wakeup_providers.append(provider)
+
+    def unregister_wakeup_provider(self, provider):
+        self._wakeup_providers.remove(provider)
+
+    def enable_profiler(self, log_path=PROFILE_LOG):
+        self.profiler = Profiler(log_path)
+        InternalEvent.manager.profiler = self.profiler
+
+    def toggle_profiler_overlay(self):
+        self.profiler.overlay = not self.profiler.overlay
+        if self.profiler.overlay:
+            self.register_drawer(
+                'gui', self.profiler.draw, bounds=self.profiler.get_rect)
+        else:
+            self.unregister_drawer('gui', self.profiler.draw)
+
+    def schedule_event(self, tick, event):
+        """Handle the event as if it arrived right before the given tick."""
+        self._scheduled_events.setdefault(tick, []).append(event)
+
+    def load_input_script(self, path):
+        with open(path) as f:
+            for tick, events in parse_input_script(f):
+                for event in events:
+                    self.schedule_event(tick, event)
+
+    def register_drawer(self, id_, drawer, static=False, bounds=None):
+        """Register a drawer for the given render.txt layer.
+
+        Drawers should return the rect (or the list of rects) they touched,
+        the way Surface.blit does. They may be called more than once per
+        frame.
+
+        Non-static drawers should also pass bounds, a callable returning
+        the rects the drawer is going to touch without drawing anything.
+        Otherwise dirty frames call them twice to find that out.
+
+        Static drawers must draw the same content every time until
+        invalidate_background() or invalidate_rect() is called. Those below
+        all other drawers are pre-composited into the background, the rest
+        are only redrawn under dirty rects.
+        """
+        if id_ not in layer_indexes:
+            raise ValueError("Unknown render layer '{}'".format(id_))
+
+        index = layer_indexes[id_]
+        layer = self._layers[index]
+        if drawer in layer:
             raise ValueError("Drawer is already registered")
 
-        self._drawers.append((id_, drawer))
-        self._drawers.sort(key=lambda item: render_order.index(item[0]))
+        layer[drawer] = static
+        if bounds is not None:
+            self._drawer_bounds[drawer] = bounds
+
+        if static or index <= self._baked_layer:
+            self.invalidate_background()
+
+        self.invalidate()
 
     def unregister_drawer(self, id_, drawer):
-        self._drawers.remove((id_, drawer))
+        self._drawer_bounds.pop(drawer, None)
+        if self._layers[layer_indexes[id_]].pop(drawer):
+            self.invalidate_background()
+
+        self.invalidate()
+
+    def invalidate(self):
+        """Mark that the next frame differs from the last drawn one."""
+        self._changed = True
+
+    def invalidate_background(self):
+        self._background = None
+        self._full_redraw = True
+        self._changed = True
+
+    def invalidate_rect(self, id_, rect):
+        """Mark that static drawers of the given layer changed in rect."""
+        if layer_indexes[id_] <= self._baked_layer:
+            self.invalidate_background()
+            return
+
+        # Everything gets redrawn anyway
+        if not self._full_redraw:
+            self._invalid_rects.append(Rect(rect))
+
+        self._changed = True
+
+    def scroll_background(self, id_, dx, dy):
+        """Mark that static drawers up to the given layer moved by
+        (dx, dy) screen pixels.
+
+        The baked background is scrolled and only the exposed strips are
+        redrawn, as long as no layer above the given one is baked.
+        """
+        if self._background is None:
+            return
+
+        if (layer_indexes[id_] < self._baked_layer
+                or abs(dx) >= WIDTH or abs(dy) >= HEIGHT):
+            self.invalidate_background()
+            return
+
+        self._background.scroll(dx, dy)
+
+        strips = []
+        if dx > 0:
+            strips.append(Rect(0, 0, dx, HEIGHT))
+        elif dx < 0:
+            strips.append(Rect(WIDTH + dx, 0, -dx, HEIGHT))
+
+        if dy > 0:
+            strips.append(Rect(0, 0, WIDTH, dy))
+        elif dy < 0:
+            strips.append(Rect(0, HEIGHT + dy, WIDTH, -dy))
+
+        for rect in strips:
+            self._redraw_background(rect)
+
+        # Everything on the screen has moved
+        self._full_redraw = True
+        self._changed = True
+
+    def set_idle(self, state):
+        """Only draw invalidated frames and sleep in between."""
+        self._idle = state
+
+    def _render_background(self):
+        background = self._background_surface
+        if background is None:
+            background = pygame.Surface(RESOLUTION).convert()
+            self._background_surface = background
+
+        background.fill(BG_COLOR)
+
+        # Only whole layers made of static drawers are baked
+        self._baked_layer = -1
+        for id_, layer in zip(render_order, self._layers):
+            if not all(layer.values()):
+                break
+
+            for drawer in layer:
+                self._call_drawer(id_, drawer, background)
+
+            self._baked_layer += 1
+
+        self._background = background
+
+    def _redraw_background(self, rect):
+        """Redraw baked layers within rect of the background."""
+        self._background.set_clip(rect)
+        self._background.fill(BG_COLOR)
+        for index in range(self._baked_layer + 1):
+            for drawer in self._layers[index]:
+                self._call_drawer(
+                    render_order[index], drawer, self._background)
+
+        self._background.set_clip(None)
+
+    def _iter_drawers(self):
+        """Yield (layer id, drawer, static) for drawers that aren't baked."""
+        for index in range(self._baked_layer + 1, len(self._layers)):
+            for drawer, static in self._layers[index].items():
+                yield render_order[index], drawer, static
+
+    def _call_drawer(self, id_, drawer, dest):
+        if self.profiler is None:
+            return drawer(dest)
+
+        return self.profiler.call("draw " + id_, drawer, dest)
 
     def toggle_fullscreen(self, state=None):
         fullscreen = not self._fullscreen if state is None else state
@@ -103,48 +443,258 @@ class MainApp:
 
         self._fullscreen = fullscreen
 
+        # Display pixel format may have changed
+        self._background_surface = None
+        self.invalidate_background()
+
     def quit(self):
         self._running = False
 
     def loop(self):
         self._running = True
+        self._last_tick_time = pygame.time.get_ticks()
+
+        while self._running:
+            if self._idle and not self._changed:
+                events = self._wait_idle()
+
+                # Catch up on ticks that passed while waiting, before
+                # handling the events that woke us up
+                self._run_ticks(self._get_elapsed_ticks())
+                max_ticks = None
+            else:
+                self._clock.tick(MAX_FRAMERATE)
+                events = pygame.event.get()
+                max_ticks = MAX_CATCHUP_TICKS
+
+            if self.profiler is None:
+                self._update(events, max_ticks)
+                continue
+
+            started_at = time.perf_counter()
+            self._update(events, max_ticks)
+            self.profiler.add_sample(
+                'frame', time.perf_counter() - started_at)
+
+            if self.profiler.update():
+                self.invalidate()
+
+    def _update(self, events, max_ticks):
+        self._handle_events(events)
+        self._run_ticks(self._get_elapsed_ticks(max_ticks))
+        self.interpolation = min(
+            1, (pygame.time.get_ticks() - self._last_tick_time) /
+            TICK_LENGTH)
+
+        for listener in tuple(self._frame_listeners):
+            if self.profiler is None:
+                listener()
+            else:
+                self.profiler.call('frame', listener)
+
+        if self._idle and not self._changed:
+            return
+
+        self._changed = False
+        self._draw_frame()
+
+    def loop_headless(self, ticks=None):
+        """Run ticks back to back without drawing anything.
+
+        Input comes from the event queue and scheduled events. Stop after
+        the given number of ticks if it's not None.
+        """
+        self._running = True
+        self.interpolation = 1
 
         while self._running:
-            self._clock.tick(TICKRATE)
+            if ticks is not None and self.tick_number >= ticks:
+                break
+
+            events = pygame.event.get()
+            events.extend(self._scheduled_events.pop(self.tick_number, ()))
 
-            for e in pygame.event.get():
-                if e.type == QUIT:
-                    self._running = False
+            self._handle_events(events)
+            self._run_ticks(1)
 
-                elif (e.type is KEYDOWN and e.key == K_RETURN and
-                              (e.mod & (KMOD_LALT | KMOD_RALT)) != 0):
+    def _handle_events(self, events):
+        profiler = self.profiler
+        for e in events:
+            if e.type == QUIT:
+                self._running = False
 
-                    self.toggle_fullscreen()
+            elif (e.type is KEYDOWN and e.key == K_RETURN and
+                          (e.mod & (KMOD_LALT | KMOD_RALT)) != 0):
 
-                # Call event-specific handlers
-                for handler in self._event_handlers.get(e.type, ()):
+                self.toggle_fullscreen()
+
+            elif (e.type == KEYDOWN and e.key == PROFILER_OVERLAY_KEY and
+                          profiler is not None):
+
+                self.toggle_profiler_overlay()
+
+            if profiler is not None:
+                category = "event " + pygame.event.event_name(e.type)
+
+            # Call event-specific handlers
+            for handler in self._event_handlers.get(e.type, ()):
+                if profiler is None:
                     handler(e)
+                else:
+                    profiler.call(category, handler, e)
 
-                # Pass event to event proxies
-                for proxy in self._event_proxies:
+            # Pass event to event proxies
+            for proxy in self._event_proxies:
+                if profiler is None:
                     proxy(e)
+                else:
+                    profiler.call(category, proxy, e)
 
-            for listener in self._tick_listeners:
-                listener()
+        InternalEvent.drain()
+
+    def _run_ticks(self, ticks):
+        profiler = self.profiler
+        for i in range(ticks):
+            # Listeners may unregister themselves while being called
+            for listener in tuple(self._tick_listeners):
+                if profiler is None:
+                    listener()
+                else:
+                    profiler.call('tick', listener)
+
+            # Events deferred during the tick are handled before the next one
+            InternalEvent.drain()
+
+            self.tick_number += 1
+
+    def _wait_idle(self):
+        timeout = IDLE_TIMEOUT
+        for provider in self._wakeup_providers:
+            seconds = provider()
+            if seconds is not None:
+                timeout = min(timeout, seconds)
+
+        # Zero timeout would make pygame wait forever
+        e = pygame.event.wait(max(1, int(timeout * 1000)))
+        if e.type == NOEVENT:
+            return pygame.event.get()
+
+        return [e] + pygame.event.get()
+
+    def _get_elapsed_ticks(self, max_ticks=None):
+        """Return the number of whole ticks passed since the last call.
+
+        If there are more than max_ticks of them, the rest are dropped so
+        that a slow frame doesn't make the next ones even slower.
+        """
+        ticks = int((pygame.time.get_ticks() - self._last_tick_time) //
+                    TICK_LENGTH)
+
+        self._last_tick_time += ticks * TICK_LENGTH
+        if max_ticks is not None:
+            return min(ticks, max_ticks)
+
+        return ticks
+
+    def _draw_frame(self):
+        if self._background is None:
+            self._render_background()
+
+        if self._full_redraw or not self.dirty_rendering:
+            self._draw_full()
+
+        elif not self._draw_dirty():
+            self._draw_full()
+
+    def _draw_full(self):
+        self._screen.blit(self._background, (0, 0))
 
-            self._screen.fill(BG_COLOR)
+        drawn_rects = []
+        full_redraw = False
+        for id_, drawer, static in self._iter_drawers():
+            rects = self._call_drawer(id_, drawer, self._screen)
+            if static:
+                continue
 
-            for id_, drawer in self._drawers:
-                drawer(self._screen)
+            if not collect_rects(rects, drawn_rects):
+                full_redraw = True
 
-            pygame.display.update()
+        self._drawn_rects = drawn_rects
+        self._invalid_rects = []
+        self._full_redraw = full_redraw
+
+        pygame.display.update()
+
+    def _draw_dirty(self):
+        """Redraw only what changed since the previous frame.
+
+        Return False if the frame needs a full redraw instead.
+        """
+        drawers = list(self._iter_drawers())
+
+        # Find out where non-static drawers draw this time first. Drawers
+        # without bounds have to draw for that, it gets erased below
+        drawn_rects = []
+        for id_, drawer, static in drawers:
+            if static:
+                continue
+
+            bounds = self._drawer_bounds.get(drawer)
+            if bounds is None:
+                rects = self._call_drawer(id_, drawer, self._screen)
+            else:
+                rects = bounds()
+
+            if not collect_rects(rects, drawn_rects):
+                return False
+
+        dirty_rects = merge_rects(
+            self._drawn_rects + drawn_rects + self._invalid_rects)
+        if get_area(dirty_rects) > WIDTH * HEIGHT * MAX_DIRTY_RATIO:
+            return False
+
+        for rect in dirty_rects:
+            self._screen.blit(self._background, rect, rect)
+
+        # Dirty rects don't overlap, so static layers with translucent
+        # pixels are applied exactly once
+        for id_, drawer, static in drawers:
+            if not static:
+                self._call_drawer(id_, drawer, self._screen)
+                continue
+
+            for rect in dirty_rects:
+                self._screen.set_clip(rect)
+                self._call_drawer(id_, drawer, self._screen)
+
+            self._screen.set_clip(None)
+
+        self._drawn_rects = drawn_rects
+        self._invalid_rects = []
+
+        pygame.display.update(dirty_rects)
+        return True
 
 
 def main(argv):
+    args = parse_args(argv)
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    else:
+        sys.stderr = open('stderr.log', 'w')
+        sys.stdout = open('stdout.log', 'w')
+
+    pygame.init()
     set_caption(WINDOW_TITLE)
 
     print("Initializing application...")
-    app = MainApp(argv)
+    app = MainApp(argv, headless=args.headless)
+    if args.profile:
+        app.enable_profiler()
+
+    if args.script:
+        app.load_input_script(args.script)
 
     print("Loading modules...")
     import modules
@@ -153,7 +703,18 @@ def main(argv):
     InternalEvent.fire('load', app=app)
 
     print("Entering main loop...")
-    app.loop()
+    if args.headless:
+        started_at = time.perf_counter()
+        app.loop_headless(args.ticks)
+        elapsed = time.perf_counter() - started_at
+
+        print("Ran {} ticks in {:.2f}s ({:.0f} ticks/s)".format(
+            app.tick_number, elapsed, app.tick_number / max(elapsed, 1e-9)))
+    else:
+        app.loop()
+
+    if app.profiler is not None:
+        app.profiler.dump()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+from io import BytesIO
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.olbmp import SUPPORTED_VERSIONS, OLBitMap
+
+
+def round_trip(image):
+    f = BytesIO()
+    image.save(f)
+    return OLBitMap(f.getvalue())
+
+
+def test_round_trip():
+    for version in SUPPORTED_VERSIONS:
+        image = OLBitMap((3, 2))
+        image[1, 1] = (1, 2, 3, 4)
+        image.version = version
+
+        loaded = round_trip(image)
+        assert (loaded.width, loaded.height) == (3, 2)
+        assert bytes(loaded.get_buffer()) == bytes(image.get_buffer())
+
+
+def test_round_trip_empty():
+    for width, height in ((0, 5), (5, 0), (0, 0)):
+        for version in SUPPORTED_VERSIONS:
+            image = OLBitMap((width, height))
+            image.version = version
+
+            loaded = round_trip(image)
+            assert (loaded.width, loaded.height) == (width, height)
+            assert bytes(loaded.get_buffer()) == b''
+
+
+def test_lazy_load(tmp_path):
+    for version in SUPPORTED_VERSIONS:
+        image = OLBitMap((4, 3))
+        image[2, 1] = (5, 6, 7, 8)
+        image.version = version
+
+        path = str(tmp_path / "image{}.olbmp".format(version))
+        image.save(path)
+
+        with OLBitMap(path, lazy=True) as loaded:
+            assert loaded[2, 1] == (5, 6, 7, 8)
+            assert bytes(loaded.get_row(1)) == bytes(image.get_row(1))
+            assert loaded.get_region(1, 0, 2, 3) == image.get_region(
+                1, 0, 2, 3)
+
+            assert bytes(loaded.get_buffer()) == bytes(image.get_buffer())
@@ -0,0 +1,49 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import __main__
+if not hasattr(__main__, 'get_resource'):
+    __main__.get_resource = lambda path: os.path.join(ROOT, path)
+
+from pygame import Surface
+
+from constants import NODE_H, NODE_W
+from modules import snake as snake_module
+from modules.snake import Snake, SnakeNode
+
+
+def make_snake(cells):
+    snake = Snake(*cells[0])
+    for cell in cells:
+        snake._cells.append(cell)
+        snake._occupy(cell)
+        snake._nodes.append(SnakeNode())
+
+    snake.render()
+    return snake
+
+
+def test_body_keeps_cells_shared_by_nodes():
+    snake_module.node_textures[:] = [Surface((NODE_W, NODE_H))] * 16
+
+    # Coiled so that the next tail lands on the second node
+    snake = make_snake([(7, 4), (6, 4), (6, 5), (6, 6), (5, 6), (4, 6),
+                        (4, 5), (4, 4), (5, 4)])
+    try:
+        snake.increment()
+        assert snake._cells[-1] == (6, 4)
+
+        snake.decrement()
+        assert (6, 4) in snake._body_cells
+
+        snake.increment()
+        snake.tick()
+        assert snake._cells[0] == (8, 4)
+        for cell in list(snake)[1:]:
+            assert cell in snake._body_cells
+
+    finally:
+        snake.clear()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from libs.surface_cache import ENTRY_EXT, ENTRY_HEADER, SurfaceCache
+
+
+def build():
+    surface = pygame.Surface((4, 3), pygame.SRCALPHA)
+    surface.fill((1, 2, 3, 4))
+    return surface
+
+
+def test_corrupt_masks_rebuild(tmp_path):
+    source = tmp_path / "image.olbmp"
+    source.write_bytes(b'image')
+    cache = SurfaceCache(str(tmp_path / "cache"), 1024 * 1024)
+    cache.get(str(source), build)
+
+    entry_path, = (tmp_path / "cache").glob('*' + ENTRY_EXT)
+    data = entry_path.read_bytes()
+    *fields, r, g, b, a = ENTRY_HEADER.unpack_from(data)
+    entry_path.write_bytes(
+        ENTRY_HEADER.pack(*fields, r, r, r, r) + data[ENTRY_HEADER.size:])
+
+    builds = []
+    surface = cache.get(str(source), lambda: builds.append(1) or build())
+    assert builds == [1]
+    assert surface.get_at((0, 0)) == (1, 2, 3, 4)
+
+    # The rebuilt entry replaced the damaged one
+    assert cache.get(str(source), lambda: None).get_at((0, 0)) == (1, 2, 3, 4)